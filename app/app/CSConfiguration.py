@@ -17,6 +17,7 @@ class CSConfiguration(object):
             'cyops_url': '',
             'username': '',
             'password': '',
+            'max_batch_size': '100',
         }
 
     def read_configuration(self):
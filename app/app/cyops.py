@@ -1,10 +1,62 @@
 import requests
 import json
+import base64
+import hashlib
+import threading
+import time
 from CSConfiguration import CSConfiguration
 from qpylib import qpylib
 import sys
+from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
+# Tokens are reused until shortly before they expire. The expiry is read from the
+# token itself (JWT exp claim) and defaults to TOKEN_TTL seconds otherwise.
+TOKEN_TTL = 600
+TOKEN_REFRESH_MARGIN = 60
+POOL_SIZE = 10
+REQUEST_TIMEOUT = (10, 120)
+# Offense IDs sent per trigger request by send_offense_ids, unless configured otherwise
+MAX_BATCH_SIZE = 100
+
+token_cache = {}
+token_cache_lock = threading.Lock()
+session = None
+session_lock = threading.Lock()
+
+
+def get_session():
+    """ Session shared by all requests to FortiSOAR, keeping connections alive """
+    global session
+    if session is None:
+        with session_lock:
+            if session is None:
+                requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+                new_session = requests.Session()
+                new_session.verify = False
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                new_session.mount('https://', adapter)
+                session = new_session
+    return session
+
+
+class PartialDelivery(Exception):
+    """ Raised when only some chunks of a bulk delivery were sent """
+
+    def __init__(self, message, delivered):
+        super(PartialDelivery, self).__init__(message)
+        self.delivered = delivered
+
+
+def token_expiry(token):
+    """ Returns the exp claim of a JWT, or None when the token is not a JWT """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(str(payload)))['exp'])
+    except Exception:
+        return None
+
 
 class CyOPs(object):
     def __init__(self, config):
@@ -19,13 +71,48 @@ class CyOPs(object):
         except:
             qpylib.log("Exception while reading config: " + str(sys.exc_info()[0]))
 
-    def getToken(self, username, password):
+    def token_key(self):
+        return self.url, self.user, hashlib.sha256(json.dumps(self.password).encode('utf-8')).hexdigest()
+
+    def getToken(self, username, password, refresh=False):
+        key = self.token_key()
+        if not refresh:
+            with token_cache_lock:
+                cached = token_cache.get(key)
+            if cached is not None and cached[1] - TOKEN_REFRESH_MARGIN > time.time():
+                return cached[0]
         endpoint = 'https://' + self.url + '/auth/authenticate'
         qpylib.log('fetching token from endpoint: ' + endpoint)
         data = {'credentials': {'loginid': self.user, 'password': self.password, 'token': ''}}
-        ret = requests.post(endpoint, data=json.dumps(data), headers={'Content-Type': 'application/json'}, verify=False)
+        ret = get_session().post(endpoint, data=json.dumps(data), headers={'Content-Type': 'application/json'},
+                                 timeout=REQUEST_TIMEOUT)
+        if not ret.ok:
+            raise Exception(
+                'Authentication failed with response code {} and content {}'.format(ret.status_code, ret.content))
         resp = ret.json()
-        return resp['token']
+        token = resp['token']
+        expires = token_expiry(token) or time.time() + TOKEN_TTL
+        with token_cache_lock:
+            token_cache[key] = (token, expires)
+        return token
+
+    def invalidate_token(self):
+        with token_cache_lock:
+            token_cache.pop(self.token_key(), None)
+
+    def post_trigger(self, uri, payload):
+        """ Posts to a FortiSOAR trigger, authenticating again once if the cached token was rejected """
+        response = None
+        for refresh in [False, True]:
+            token = self.getToken(self.user, self.password, refresh=refresh)
+            token = json.dumps(token)
+            headers = {"Authorization": "Bearer " + token + ""}
+            response = get_session().post(uri, json=payload, headers=headers, timeout=REQUEST_TIMEOUT)
+            if response.status_code != 401:
+                break
+            qpylib.log('Token rejected by ' + uri + ', authenticating again')
+            self.invalidate_token()
+        return response
 
     def send_offense_id(self, offense_id):
         payload_dict = {"Offense_ID": str(offense_id)}
@@ -34,12 +121,7 @@ class CyOPs(object):
             return 'Configure the CyberSponse Server details before forwarding the offense data.'
         uri = 'https://' + self.url + '/api/triggers/1/qradar'
         qpylib.log('URI: ' + uri)
-        token = self.getToken(self.user, self.password)
-        token = json.dumps(token)
-        # print(token)
-        headers = {"Authorization": "Bearer " + token + ""}
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-        response = requests.post(uri, verify=False, json=payload_dict, headers=headers)
+        response = self.post_trigger(uri, payload_dict)
 
         if not response.ok:
             raise Exception(
@@ -47,3 +129,34 @@ class CyOPs(object):
 
         else:
             return 'Offense details sent to ' + uri
+
+    def send_offense_ids(self, offense_ids, max_batch_size=None):
+        """
+        Forwards many offenses with one trigger request per chunk of offense IDs. The trigger
+        payload carries the chunk as an Offense_IDs list, and as a comma separated Offense_ID
+        for playbooks that filter offenses with id in ({{ Offense_ID }}).
+        @param max_batch_size: offense IDs per request, defaults to the max_batch_size setting
+        @return message describing the delivery
+        @raise PartialDelivery when a chunk failed, listing the offense IDs that were sent before
+        """
+        if (self.url == '') or (self.user == '') or (self.password == ''):
+            return 'Configure the CyberSponse Server details before forwarding the offense data.'
+        ids = []
+        for offense_id in offense_ids:
+            if str(offense_id) not in ids:
+                ids.append(str(offense_id))
+        size = int(max_batch_size or self.config.get('max_batch_size') or MAX_BATCH_SIZE)
+        uri = 'https://' + self.url + '/api/triggers/1/qradar'
+        qpylib.log('Send ' + str(len(ids)) + ' offense IDs to ' + uri + ' in chunks of ' + str(size))
+        delivered = []
+        for start in range(0, len(ids), size):
+            chunk = ids[start:start + size]
+            try:
+                response = self.post_trigger(uri, {"Offense_ID": ','.join(chunk), "Offense_IDs": chunk})
+            except Exception:
+                raise PartialDelivery(str(sys.exc_info()[1]), delivered)
+            if not response.ok:
+                raise PartialDelivery('Received non-OK response code {} with content {}'.format(
+                    response.status_code, response.content), delivered)
+            delivered.extend(chunk)
+        return 'Details of ' + str(len(ids)) + ' offenses sent to ' + uri
@@ -0,0 +1,305 @@
+__author__ = 'CyberSponse Inc-Tushar Kanade'
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from CSConfiguration import CSConfiguration
+from cyops import CyOPs, PartialDelivery
+from qpylib import qpylib
+
+# Failed deliveries are retried with exponential backoff, starting at RETRY_BASE
+# seconds and capped at RETRY_MAX, and given up after MAX_ATTEMPTS attempts.
+MAX_ATTEMPTS = 8
+RETRY_BASE = 5
+RETRY_MAX = 600
+POLL_INTERVAL = 30
+# A job is moved to the in-flight directory while it is being sent; one left there this
+# many seconds by a worker that died is put back in the queue.
+INFLIGHT_TIMEOUT = 600
+# Bulk deliveries wait this many seconds for more offenses to send them together,
+# and at most BULK_LIMIT of them are handed to one send_many call.
+COALESCE_WINDOW = 2
+BULK_LIMIT = 1000
+
+
+class ForwardQueue(object):
+    """
+    Offenses waiting to be forwarded to FortiSOAR. Each pending delivery is a JSON file
+    under the app store directory, so deliveries survive an app restart; a background
+    worker sends them and retries failures with backoff. A worker claims a job by renaming
+    it into the in-flight directory before sending it, so several workers sharing the
+    directory never send the same job.
+    """
+
+    def __init__(self, directory, send, send_many=None):
+        """
+        @param directory: directory holding the pending, in-flight and failed deliveries
+        @param send: function delivering an offense ID, raising on failure
+        @param send_many: function delivering a list of offense IDs together, raising
+        PartialDelivery when only some of them were sent
+        """
+        self.pending_dir = os.path.join(directory, 'pending')
+        self.inflight_dir = os.path.join(directory, 'inflight')
+        self.failed_dir = os.path.join(directory, 'failed')
+        self.send = send
+        self.send_many = send_many
+        self.condition = threading.Condition()
+        self.worker = None
+        self.wakeup = False
+        self.stats = {
+            'delivered': 0,
+            'failed': 0,
+            'retries': 0,
+            'last_error': None,
+            'last_delivery': None,
+            'latency_last': None,
+            'latency_avg': None,
+            'latency_max': None,
+        }
+        for path in [self.pending_dir, self.inflight_dir, self.failed_dir]:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def write_job(self, path, job):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as job_file:
+            json.dump(job, job_file)
+        os.rename(tmp_path, path)
+
+    def read_job(self, path):
+        try:
+            with open(path) as job_file:
+                return json.load(job_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def list_jobs(self, directory):
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+        return [os.path.join(directory, name) for name in names]
+
+    def pending_jobs(self):
+        return self.list_jobs(self.pending_dir)
+
+    def claim(self, path):
+        """
+        Moves a due job into the in-flight directory
+        @return path of the claimed job, or None when another worker claimed it first
+        """
+        claimed = os.path.join(self.inflight_dir, os.path.basename(path))
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        # rename keeps the modification time, which dates the claim for recover_stale
+        os.utime(claimed, None)
+        return claimed
+
+    def recover_stale(self):
+        """
+        Puts back in the queue the in-flight jobs of a worker that died while sending them
+        """
+        for path in self.list_jobs(self.inflight_dir):
+            try:
+                if time.time() - os.path.getmtime(path) > INFLIGHT_TIMEOUT:
+                    os.rename(path, os.path.join(self.pending_dir, os.path.basename(path)))
+                    qpylib.log('Requeued stale in-flight delivery ' + os.path.basename(path), 'warning')
+            except OSError:
+                continue
+
+    def enqueue(self, offense_id, bulk=False):
+        return self.enqueue_many([offense_id], bulk=bulk)[0]
+
+    def enqueue_many(self, offense_ids, bulk=True):
+        """
+        Queues offenses for delivery; bulk deliveries are coalesced and sent together
+        """
+        now = time.time()
+        jobs = []
+        for index, offense_id in enumerate(offense_ids):
+            job = {'offense_id': str(offense_id), 'enqueued': now, 'attempts': 0, 'next_attempt': now,
+                   'last_error': None, 'bulk': bool(bulk)}
+            name = '%017.6f_%06d_%s.json' % (now, index, uuid.uuid4().hex)
+            self.write_job(os.path.join(self.pending_dir, name), job)
+            jobs.append(job)
+        qpylib.log('Queued ' + str(len(jobs)) + ' offenses for delivery to FortiSOAR')
+        self.start()
+        with self.condition:
+            self.wakeup = True
+            self.condition.notify()
+        return jobs
+
+    def start(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.run, name='forward-queue')
+            self.worker.daemon = True
+            self.worker.start()
+
+    def run(self):
+        while True:
+            try:
+                wait = self.process_due()
+            except Exception:
+                qpylib.log('Forward queue worker error: ' + str(sys.exc_info()[1]), 'error')
+                wait = POLL_INTERVAL
+            with self.condition:
+                if not self.wakeup:
+                    self.condition.wait(min(wait, POLL_INTERVAL))
+                self.wakeup = False
+
+    def process_due(self):
+        """
+        Delivers every job that is due
+        @return seconds until the next job is due
+        """
+        self.recover_stale()
+        next_due = POLL_INTERVAL
+        bulk = []
+        for path in self.pending_jobs():
+            job = self.read_job(path)
+            if job is None:
+                continue
+            now = time.time()
+            if job['next_attempt'] > now:
+                next_due = min(next_due, job['next_attempt'] - now)
+                continue
+            if job.get('bulk') and self.send_many is not None:
+                bulk.append((path, job))
+                continue
+            path = self.claim(path)
+            if path is not None and not self.deliver(path, job):
+                next_due = min(next_due, job['next_attempt'] - time.time())
+        if bulk:
+            # Jobs are sorted by enqueue time, so the first one decides when the window closes;
+            # retries wait for it too, so that offenses queued meanwhile are sent with them
+            remaining = bulk[0][1]['next_attempt'] + COALESCE_WINDOW - time.time()
+            if remaining > 0:
+                next_due = min(next_due, remaining)
+            else:
+                claimed = [(self.claim(path), job) for path, job in bulk]
+                claimed = [(path, job) for path, job in claimed if path is not None]
+                for start in range(0, len(claimed), BULK_LIMIT):
+                    for job in self.deliver_many(claimed[start:start + BULK_LIMIT]):
+                        next_due = min(next_due, job['next_attempt'] - time.time())
+        return max(next_due, 0)
+
+    def deliver(self, path, job):
+        try:
+            self.send(job['offense_id'])
+        except Exception:
+            self.failed(path, job, str(sys.exc_info()[1]))
+            return False
+        self.delivered(path, job)
+        return True
+
+    def deliver_many(self, entries):
+        """
+        @return the jobs that failed and are scheduled again
+        """
+        offense_ids = [job['offense_id'] for path, job in entries]
+        try:
+            self.send_many(offense_ids)
+        except PartialDelivery as err:
+            sent, error = set(err.delivered), str(err)
+        except Exception:
+            sent, error = set(), str(sys.exc_info()[1])
+        else:
+            sent, error = set(offense_ids), None
+        retried = []
+        for path, job in entries:
+            if job['offense_id'] in sent:
+                self.delivered(path, job)
+            else:
+                # the jobs of one request are retried together, as one request again
+                self.failed(path, job, error, retried[0]['next_attempt'] if retried else None)
+                retried.append(job)
+        return retried
+
+    def delivered(self, path, job):
+        os.remove(path)
+        latency = time.time() - job['enqueued']
+        count = self.stats['delivered']
+        self.stats['delivered'] = count + 1
+        self.stats['last_delivery'] = time.time()
+        self.stats['latency_last'] = latency
+        self.stats['latency_avg'] = ((self.stats['latency_avg'] or 0) * count + latency) / (count + 1)
+        self.stats['latency_max'] = max(self.stats['latency_max'] or 0, latency)
+
+    def failed(self, path, job, error, next_attempt=None):
+        """
+        Schedules the next attempt of a claimed job, or moves it to the failed directory after MAX_ATTEMPTS
+        @param next_attempt: time of the next attempt, by default set by the backoff
+        """
+        name = os.path.basename(path)
+        job['attempts'] += 1
+        job['last_error'] = error
+        self.stats['last_error'] = error
+        if job['attempts'] >= MAX_ATTEMPTS:
+            qpylib.log('Giving up forwarding offense ' + job['offense_id'] + ' after ' +
+                       str(job['attempts']) + ' attempts: ' + error, 'error')
+            self.write_job(os.path.join(self.failed_dir, name), job)
+            os.remove(path)
+            self.stats['failed'] += 1
+            job['next_attempt'] = time.time() + POLL_INTERVAL
+            return
+        if next_attempt is None:
+            delay = min(RETRY_MAX, RETRY_BASE * 2 ** (job['attempts'] - 1))
+            next_attempt = time.time() + random.uniform(delay / 2.0, delay)
+        job['next_attempt'] = next_attempt
+        self.write_job(os.path.join(self.pending_dir, name), job)
+        os.remove(path)
+        self.stats['retries'] += 1
+        qpylib.log('Forwarding offense ' + job['offense_id'] + ' failed, retrying in ' +
+                   str(int(job['next_attempt'] - time.time())) + 's: ' + error, 'warning')
+
+    def status(self):
+        pending = self.pending_jobs()
+        inflight = self.list_jobs(self.inflight_dir)
+        oldest = None
+        if pending or inflight:
+            oldest = min(float(os.path.basename(path).split('_')[0]) for path in pending + inflight)
+        status = dict(self.stats)
+        status.update({
+            'depth': len(pending) + len(inflight),
+            'in_flight': len(inflight),
+            'oldest_pending_age': time.time() - oldest if oldest is not None else None,
+            'failed_pending_review': len([name for name in os.listdir(self.failed_dir) if name.endswith('.json')]),
+            'worker_alive': self.worker is not None and self.worker.is_alive(),
+        })
+        return status
+
+
+forward_queue = None
+forward_queue_lock = threading.Lock()
+
+
+def send_offense(offense_id):
+    csconfig = CSConfiguration()
+    csconfig.read_configuration()
+    result = CyOPs(csconfig.config).send_offense_id(offense_id)
+    if not result.startswith('Offense details sent'):
+        raise Exception(result)
+    return result
+
+
+def send_offenses(offense_ids):
+    csconfig = CSConfiguration()
+    csconfig.read_configuration()
+    result = CyOPs(csconfig.config).send_offense_ids(offense_ids)
+    if not result.startswith('Details of'):
+        raise Exception(result)
+    return result
+
+
+def get_forward_queue():
+    global forward_queue
+    if forward_queue is None:
+        with forward_queue_lock:
+            if forward_queue is None:
+                forward_queue = ForwardQueue(qpylib.get_store_path('forward_queue'), send_offense,
+                                             send_many=send_offenses)
+    return forward_queue
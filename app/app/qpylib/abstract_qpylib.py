@@ -14,10 +14,33 @@ import offense_qpylib
 import asset_qpylib
 import json_qpylib
 import json
+import threading
+import time
+from requests.adapters import HTTPAdapter
+
+try:
+    from cookielib import DefaultCookiePolicy
+except ImportError:
+    from http.cookiejar import DefaultCookiePolicy
 
 loggerName = 'com.ibm.applicationLogger'
 logger = 0
 
+# Parsed manifests by location, as (mtime, checked at, manifest). The mtime is
+# checked at most once per MANIFEST_CHECK_INTERVAL seconds.
+MANIFEST_CHECK_INTERVAL = 1.0
+manifest_cache = {}
+# Log line prefixes by (app id, level)
+log_prefixes = {}
+
+# Connections to the console are kept alive in one pool shared by all REST calls.
+# Timeouts are in seconds, a read timeout of None waits indefinitely as before.
+REST_POOL_SIZE = int(os.getenv('QPYLIB_REST_POOL_SIZE', '10'))
+REST_CONNECT_TIMEOUT = float(os.getenv('QPYLIB_REST_CONNECT_TIMEOUT', '10'))
+REST_READ_TIMEOUT = float(os.getenv('QPYLIB_REST_READ_TIMEOUT', '0')) or None
+rest_session = None
+rest_session_lock = threading.Lock()
+
 class AbstractQpylib(object):
     __metaclass__ = ABCMeta
 
@@ -33,33 +56,68 @@ class AbstractQpylib(object):
     def get_manifest_location(self):
         pass
 
+    def get_rest_session(self):
+        global rest_session
+        if rest_session is None:
+            with rest_session_lock:
+                if rest_session is None:
+                    session = requests.Session()
+                    session.verify = False
+                    # SEC and CSRF tokens are passed per request, cookies set by one
+                    # user's response must not be replayed for another user
+                    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                    adapter = HTTPAdapter(pool_connections=REST_POOL_SIZE, pool_maxsize=REST_POOL_SIZE)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    rest_session = session
+        return rest_session
+
+    def configure_rest(self, pool_size=None, connect_timeout=None, read_timeout=None):
+        """
+        Changes the REST pool size and timeouts; the pool is rebuilt on the next call
+        """
+        global rest_session, REST_POOL_SIZE, REST_CONNECT_TIMEOUT, REST_READ_TIMEOUT
+        with rest_session_lock:
+            if pool_size is not None:
+                REST_POOL_SIZE = int(pool_size)
+            if connect_timeout is not None:
+                REST_CONNECT_TIMEOUT = float(connect_timeout)
+            if read_timeout is not None:
+                REST_READ_TIMEOUT = float(read_timeout) or None
+            if rest_session is not None:
+                rest_session.close()
+            rest_session = None
+
+    def RESTrequest(self, method, URL, headers, data=None,
+                    params=None, json_inst=None, auth=None):
+        return self.get_rest_session().request(method, URL, params=params,
+                                               headers=headers, verify=False, auth=auth,
+                                               data=data, json=json_inst,
+                                               timeout=(REST_CONNECT_TIMEOUT, REST_READ_TIMEOUT))
+
     def RESTget(self, URL, headers, data=None,
                 params=None, json_inst=None, auth=None):
         self.log("REST get issued to " + URL + " " + str(params), "debug")
-        return requests.get(URL, params=params,
-                            headers=headers, verify=False, auth=auth,
-                            data=data, json=json_inst)
+        return self.RESTrequest('GET', URL, headers, data=data,
+                                params=params, json_inst=json_inst, auth=auth)
 
     def RESTput(self, URL, headers, data=None,
                 params=None, json_inst=None, auth=None):
         self.log("REST put issued to " + URL + " " + str(params), "debug")
-        return requests.put(URL, params=params,
-                            headers=headers, verify=False, auth=auth,
-                            data=data, json=json_inst)
+        return self.RESTrequest('PUT', URL, headers, data=data,
+                                params=params, json_inst=json_inst, auth=auth)
 
     def RESTpost(self, URL, headers, data=None,
                  params=None, json_inst=None, auth=None):
         self.log("REST post issued to " + URL + " " + str(params), "debug")
-        return requests.post(URL, params=params,
-                            headers=headers, verify=False, auth=auth,
-                            data=data, json=json_inst)
+        return self.RESTrequest('POST', URL, headers, data=data,
+                                params=params, json_inst=json_inst, auth=auth)
 
     def RESTdelete(self, URL, headers, data=None,
                    params=None, json_inst=None, auth=None):
         self.log("REST delete issued to " + URL + " " + str(params), "debug")
-        return requests.delete(URL, params=params,
-                            headers=headers, verify=False, auth=auth,
-                            data=data, json=json_inst)
+        return self.RESTrequest('DELETE', URL, headers, data=data,
+                                params=params, json_inst=json_inst, auth=auth)
 
     def RESTunsupported(self, URL, headers, data=None,
                         params=None, json_inst=None, auth=None):
@@ -190,10 +248,20 @@ class AbstractQpylib(object):
 
     def log(self, message,  level='info'):
         log_fn = self.choose_log_level(level)
-        log_fn("127.0.0.1 " +
-               "[APP_ID/" +  self.get_app_id() + "]" +
-               "[NOT:" +  self.map_notification_code(level) + "] " +
-               message)
+        if level.upper() != 'EXCEPTION' and not logger.isEnabledFor(self.map_log_level(level)):
+            return
+        log_fn(self.log_prefix(level) + message)
+
+    def log_prefix(self, level='info'):
+        app_id = self.get_app_id()
+        key = (app_id, level.upper())
+        prefix = log_prefixes.get(key)
+        if prefix is None:
+            prefix = ("127.0.0.1 " +
+                      "[APP_ID/" + app_id + "]" +
+                      "[NOT:" + self.map_notification_code(level) + "] ")
+            log_prefixes[key] = prefix
+        return prefix
 
     def register_jsonld_type(self, context):
         if context is not None:
@@ -271,9 +339,23 @@ class AbstractQpylib(object):
 
 
     def get_manifest_json(self):
+        """
+        Returns the parsed manifest, which is only read again once its mtime changes.
+        The returned dict is shared between callers and must not be modified.
+        """
         pre_pended_manifest_location = os.path.join(self.root_path(), self.get_manifest_location())
+        now = time.time()
+        cached = manifest_cache.get(pre_pended_manifest_location)
+        if cached is not None and now - cached[1] < MANIFEST_CHECK_INTERVAL:
+            return cached[2]
+        mtime = os.stat(pre_pended_manifest_location).st_mtime
+        if cached is not None and cached[0] == mtime:
+            manifest_cache[pre_pended_manifest_location] = (mtime, now, cached[2])
+            return cached[2]
         with open(pre_pended_manifest_location) as manifest_file:
-            return json.load(manifest_file)
+            manifest = json.load(manifest_file)
+        manifest_cache[pre_pended_manifest_location] = (mtime, now, manifest)
+        return manifest
 
     def render_json_ld_type(self, jld_type, data, jld_id = None):
         return json_qpylib.render_json_ld_type(jld_type, data, jld_id)
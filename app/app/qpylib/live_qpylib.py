@@ -16,6 +16,11 @@ logfile_location = '/store/log/app.log'
 
 class LiveQpylib(AbstractQpylib):
 
+    def __init__(self):
+        # (manifest, url) pairs, rebuilt when the manifest cache returns a newly parsed manifest
+        self.console_url = (None, None)
+        self.app_base_url = (None, None)
+
     def get_manifest_location(self):
         global manifest_location
         return manifest_location
@@ -69,7 +74,7 @@ class LiveQpylib(AbstractQpylib):
     def REST(self, RESTtype, requestURL, headers=None, data=None,
              params=None, json_inst=None, version=None):
         headers = self.get_tokens(headers, version)
-        fullURL = "https://" + self.get_console_address() + "/" + requestURL
+        fullURL = self.get_console_url() + requestURL
         self.log("REST " + fullURL +
                   "RESTtype " + RESTtype +
                   "headers " + str(headers) +
@@ -80,6 +85,12 @@ class LiveQpylib(AbstractQpylib):
         return self.chooseREST(RESTtype)(URL=fullURL, headers=headers,
                                          data=data, params=params, json_inst=json_inst)
 
+    def get_console_url(self):
+        manifest = self.get_manifest_json()
+        if self.console_url[0] is not manifest:
+            self.console_url = (manifest, "https://" + self.get_console_address() + "/")
+        return self.console_url[1]
+
     def get_app_name(self):
         manifest = self.get_manifest_json()
         app_name = 'None'
@@ -100,6 +111,9 @@ class LiveQpylib(AbstractQpylib):
         appropriate Application plugin servlet
         """
         self.log("getAppBaseUrl>>>", 'debug')
+        manifest = self.get_manifest_json()
+        if self.app_base_url[0] is manifest:
+            return self.app_base_url[1]
         proxy_path = ''
 
         # read /app/manifest.json
@@ -108,7 +122,6 @@ class LiveQpylib(AbstractQpylib):
         # https://{console_ip}/console/plugins/{<}app_id}/app_proxy
         console_ip = ''
         url_suffix = ''
-        manifest = self.get_manifest_json()
         if 'console_ip' in manifest.keys():
             console_ip = str(manifest["console_ip"])
         if 'app_id' in manifest.keys():
@@ -118,6 +131,7 @@ class LiveQpylib(AbstractQpylib):
 
         self.log("proxy_path==>" + proxy_path, 'debug')
         self.log("<<<getAppBaseUrl", 'debug')
+        self.app_base_url = (manifest, proxy_path)
         return proxy_path
 
     def root_path(self):
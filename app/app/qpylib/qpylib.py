@@ -15,12 +15,25 @@ def is_sdk():
     sdk_env = os.getenv('QRADAR_APPFW_SDK', 'no').lower() == 'true'
     return sdk_env
 
+strategy_impl = None
+
 def strategy():
-    strategy_impl = LiveQpylib()
-    if is_sdk():
-        strategy_impl = SdkQpylib()
+    # The strategies hold no per request state, so one instance serves every call
+    global strategy_impl
+    if strategy_impl is None:
+        if is_sdk():
+            strategy_impl = SdkQpylib()
+        else:
+            strategy_impl = LiveQpylib()
     return strategy_impl
 
+def reset_strategy():
+    """
+    Drops the cached strategy, e.g. after QRADAR_APPFW_SDK was changed
+    """
+    global strategy_impl
+    strategy_impl = None
+
 # ===== User Utils qpylib =====
 
 def log(message, level='info'):
@@ -1,10 +1,11 @@
 __author__ = 'CyberSponse Inc-Tushar Kanade'
 
 import json
+import os
 from flask import render_template, request, redirect, url_for
 from app import app
 from CSConfiguration import CSConfiguration
-from cyops import CyOPs
+from forward_queue import get_forward_queue
 from qpylib import qpylib
 
 
@@ -25,8 +26,58 @@ def admin():
 
 @app.route('/offense_to_cyops_alert', methods=['GET', 'POST'])
 def send_offense_as_alert():
-    offense_id = request.args.get('context')
+    offense_id = (request.args.get('context') or '').strip()
+    if not offense_id.isdigit():
+        return json.dumps({'message': 'Invalid offense ID: ' + offense_id}), 400
     csconfig = CSConfiguration()
     csconfig.read_configuration()
-    cs = CyOPs(csconfig.config)
-    return json.dumps({'message': cs.send_offense_id(offense_id)})
\ No newline at end of file
+    config = csconfig.config
+    if not config.get('cyops_url') or not config.get('username') or not config.get('password'):
+        return json.dumps({'message': 'Configure the CyberSponse Server details before forwarding the offense data.'})
+    # Delivered by the forward queue worker, so the QRadar UI does not wait on FortiSOAR
+    get_forward_queue().enqueue(offense_id)
+    return json.dumps({'message': 'Offense ' + str(offense_id) + ' queued for delivery to FortiSOAR.'})
+
+
+@app.route('/offenses_to_cyops_alert', methods=['GET', 'POST'])
+def send_offenses_as_alert():
+    """
+    Queues many offenses, passed as a comma separated context or offense_ids value or a
+    JSON list, to be forwarded to FortiSOAR together
+    """
+    body = request.get_json(silent=True)
+    offense_ids = body.get('offense_ids') if isinstance(body, dict) else body
+    if offense_ids is None:
+        offense_ids = request.values.get('offense_ids') or request.values.get('context') or ''
+    if not isinstance(offense_ids, list):
+        offense_ids = str(offense_ids).split(',')
+    offense_ids = [str(offense_id).strip() for offense_id in offense_ids if str(offense_id).strip()]
+    if not offense_ids:
+        return json.dumps({'message': 'No offense IDs specified.'}), 400
+    invalid = [offense_id for offense_id in offense_ids if not offense_id.isdigit()]
+    if invalid:
+        return json.dumps({'message': 'Invalid offense IDs: ' + ', '.join(invalid)}), 400
+    csconfig = CSConfiguration()
+    csconfig.read_configuration()
+    config = csconfig.config
+    if not config.get('cyops_url') or not config.get('username') or not config.get('password'):
+        return json.dumps({'message': 'Configure the CyberSponse Server details before forwarding the offense data.'})
+    get_forward_queue().enqueue_many(offense_ids)
+    return json.dumps({'message': str(len(offense_ids)) + ' offenses queued for delivery to FortiSOAR.'})
+
+
+@app.route('/forward_queue_status', methods=['GET'])
+def forward_queue_status():
+    return json.dumps(get_forward_queue().status())
+
+
+@app.before_first_request
+def start_forward_queue():
+    get_forward_queue().start()
+
+
+# Resume deliveries that were still pending when the app stopped. Under the Werkzeug
+# reloader this module is imported by the watching parent process too, which serves no
+# requests and must not run a worker; there the worker starts with the first request.
+if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    get_forward_queue().start()
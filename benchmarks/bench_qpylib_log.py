@@ -0,0 +1,61 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+# Measures the cost of a qpylib.log() call in the QRadar app, which resolves the
+# strategy object and the app ID from the manifest on every call.
+#
+# Usage: python benchmarks/bench_qpylib_log.py [--calls N]
+# Requires the app dependencies (flask, requests) on the python path.
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, os.path.join(APP_DIR, 'app', 'qpylib'))
+
+# qpylib first, as the app does, the strategy modules import each other circularly
+import qpylib  # noqa: E402
+import abstract_qpylib  # noqa: E402
+import live_qpylib  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark qpylib.log() per call cost')
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp()
+    try:
+        manifest = os.path.join(workspace, 'manifest.json')
+        with open(os.path.join(APP_DIR, 'manifest.json')) as source:
+            content = json.load(source)
+        content.update({'app_id': 1051, 'console_ip': '127.0.0.1'})
+        with open(manifest, 'w') as target:
+            json.dump(content, target)
+        # point the live strategy at the copy and log to a null handler instead of /store/log
+        live_qpylib.manifest_location = manifest
+        logger = logging.getLogger('bench_qpylib')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        abstract_qpylib.logger = logger
+
+        for level in ['info', 'debug']:
+            seconds = timeit.timeit(lambda: qpylib.log('Send offense ID 42', level), number=args.calls)
+            print('qpylib.log level={0:<6} {1:>8.2f} us/call over {2} calls'.format(
+                level, seconds * 1e6 / args.calls, args.calls))
+    finally:
+        shutil.rmtree(workspace)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+# Micro-benchmark comparing the former double decode of QRadar responses
+# (json.loads for validation followed by response.json()) with the single
+# pass decoder used by QradarConnection.
+#
+# Usage: python benchmarks/bench_response_decode.py [offense_count] [rounds]
+import json
+import os
+import sys
+import timeit
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from qradar.utils import decode_response  # noqa: E402
+
+
+def build_response(offense_count):
+    offenses = [{
+        'id': i,
+        'description': 'Multiple Login Failures for the Same User containing Failure Audit: {}'.format(i),
+        'status': 'OPEN',
+        'magnitude': i % 10,
+        'source_address_ids': list(range(i, i + 20)),
+        'local_destination_address_ids': list(range(i, i + 5)),
+        'categories': ['User Login Failure', 'Authentication', 'Misc Login Failed'],
+        'last_updated_time': 1600000000000 + i
+    } for i in range(offense_count)]
+    response = requests.models.Response()
+    response.status_code = 200
+    response._content = json.dumps(offenses).encode('utf-8')
+    response.encoding = 'utf-8'
+    return response
+
+
+def legacy_decode(response):
+    text = response.text
+    if len(text) > 0:
+        json.loads(response.content)
+        return response.json()
+
+
+def main():
+    offense_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    response = build_response(offense_count)
+    size_mb = len(response.content) / (1024.0 * 1024.0)
+    legacy = min(timeit.repeat(lambda: legacy_decode(response), number=1, repeat=rounds))
+    single = min(timeit.repeat(lambda: decode_response(response), number=1, repeat=rounds))
+    print('payload: {0} offenses, {1:.2f} MB'.format(offense_count, size_mb))
+    print('legacy decode : {0:8.2f} ms'.format(legacy * 1000))
+    print('single decode : {0:8.2f} ms'.format(single * 1000))
+    print('speedup       : {0:8.2f}x'.format(legacy / single))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+# Local stand-in for the QRadar REST API used by the benchmark suite. It implements
+# the endpoints the connector calls (Ariel search lifecycle, paged offenses, address
+# lookups, reference sets and tables, asset model, ...) and can inject latency,
+# payload padding and error responses.
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+class FakeQRadar(object):
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, offense_count=1000, event_count=500,
+                 padding=0, search_duration=0.5, reference_set_size=1000, table_size=1000):
+        """
+        :param latency: seconds added to every response
+        :param jitter: random extra latency, up to this many seconds
+        :param error_rate: fraction of requests answered with a 503
+        :param padding: size in bytes of the filler field added to every record
+        :param search_duration: seconds an Ariel search takes to complete
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.offense_count = offense_count
+        self.event_count = event_count
+        self.padding = 'x' * padding
+        self.search_duration = search_duration
+        self.searches = {}
+        self.reference_sets = {'bench_set': ['10.0.{0}.{1}'.format(i // 256, i % 256)
+                                             for i in range(reference_set_size)]}
+        self.reference_tables = {'bench_table': {'key{}'.format(i): {'owner': 'user{}'.format(i)}
+                                                 for i in range(table_size)}}
+        self.requests = 0
+        # requests being answered right now, and the most seen at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    # ----- server lifecycle -----
+
+    def start(self, host='127.0.0.1', port=0):
+        fake = self
+
+        class Handler(FakeQRadarHandler):
+            server_state = fake
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return 'http://{0}:{1}'.format(*self._server.server_address)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    # ----- data -----
+
+    def offense(self, offense_id):
+        return {
+            'id': offense_id,
+            'description': 'Benchmark offense {}'.format(offense_id),
+            'status': 'OPEN',
+            'magnitude': offense_id % 10,
+            'source_address_ids': [offense_id, offense_id + 1],
+            'local_destination_address_ids': [offense_id],
+            'categories': ['Benchmark'],
+            # a few offenses share each last_updated_time, as offenses updated by one rule run do
+            'last_updated_time': 1600000000000 + offense_id // 4,
+            'padding': self.padding
+        }
+
+    def event(self, index):
+        return {'qid': 1000 + index, 'sourceip': '10.0.0.{}'.format(index % 256), 'starttime': 1600000000000 + index,
+                'padding': self.padding}
+
+    def search_status(self, search):
+        elapsed = time.monotonic() - search['created']
+        progress = min(100, int(100 * elapsed / self.search_duration)) if self.search_duration else 100
+        status = 'COMPLETED' if progress >= 100 else 'EXECUTE'
+        return {'search_id': search['id'], 'status': status, 'progress': progress,
+                'query_execution_time': int(elapsed * 1000),
+                'record_count': self.event_count if status == 'COMPLETED' else 0}
+
+
+class FakeQRadarHandler(BaseHTTPRequestHandler):
+    server_state = None
+    protocol_version = 'HTTP/1.1'
+    # Buffer each response into a single write, otherwise delayed ACKs add ~40ms per keep-alive request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _range(self, total):
+        match = re.match(r'items=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if not match:
+            return 0, total
+        return int(match.group(1)), min(total, int(match.group(2)) + 1)
+
+    def _paged(self, items):
+        start, end = self._range(len(items))
+        page = items[start:end]
+        content_range = 'items {0}-{1}/{2}'.format(start, start + max(len(page) - 1, 0), len(items))
+        self._send(page, headers={'Content-Range': content_range})
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw) if raw else None
+        except ValueError:
+            return None
+
+    def _dispatch(self, method):
+        state = self.server_state
+        with state._lock:
+            state.requests += 1
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        try:
+            return self._respond(state, method)
+        finally:
+            with state._lock:
+                state.in_flight -= 1
+
+    def _respond(self, state, method):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        # Path segments are unquoted individually so that values containing '/' stay one segment
+        self.path_parts = [unquote(part) for part in url.path[len('/api/'):].split('/')]
+        path = '/'.join(self.path_parts)
+        body = self._body()
+        delay = state.latency + random.uniform(0, state.jitter)
+        if delay:
+            time.sleep(delay)
+        if state.error_rate and random.random() < state.error_rate:
+            return self._send({'message': 'Injected failure'}, status=503, headers={'Retry-After': '0'})
+        handler = getattr(self, 'route_' + method.lower())
+        return handler(path, query, body)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    # ----- routes -----
+
+    def route_get(self, path, query, body):
+        state = self.server_state
+        parts = self.path_parts
+        if path == 'help/versions':
+            return self._send([{'version': '14.0'}])
+        if path == 'config/extension_management/extensions':
+            return self._send([{'name': 'CyberSponse Integration', 'version': '1.1.0', 'id': 1}])
+        if path == 'siem/offenses':
+            offenses = [state.offense(i) for i in range(1, state.offense_count + 1)]
+            # only the (last_updated_time, id) window used by incremental syncs is understood
+            since = re.search(r'last_updated_time > (\d+) or \(last_updated_time = \d+ and id > (-?\d+)\)',
+                              query.get('filter', ''))
+            if since:
+                mark = (int(since.group(1)), int(since.group(2)))
+                offenses = [o for o in offenses if (o['last_updated_time'], o['id']) > mark]
+            sort = [field.strip().lstrip('+') for field in query.get('sort', '').split(',') if field.strip()]
+            if sort and all(field in ('last_updated_time', 'id') for field in sort):
+                offenses.sort(key=lambda o: [o[field] for field in sort])
+            return self._paged(offenses)
+        if path.startswith('siem/offenses/') and path.endswith('/notes'):
+            return self._send([{'id': 1, 'note_text': 'Benchmark note'}])
+        if path == 'siem/offense_closing_reasons':
+            return self._send([{'id': 1, 'text': 'False-Positive, Tuned'}, {'id': 2, 'text': 'Non-Issue'}])
+        if path == 'siem/offense_types':
+            return self._send([{'id': 0, 'name': 'Source IP'}, {'id': 1, 'name': 'Destination IP'}])
+        if path in ['siem/source_addresses', 'siem/local_destination_addresses']:
+            ids = re.findall(r'\d+', query.get('filter', ''))
+            ip_field = 'source_ip' if 'source' in path else 'local_destination_ip'
+            return self._send([{'id': int(i), ip_field: '10.0.0.{}'.format(int(i) % 256), 'network': 'other',
+                                'magnitude': 1} for i in ids])
+        if parts[:2] == ['ariel', 'searches'] and len(parts) >= 3:
+            search = state.searches.get(parts[2])
+            if search is None:
+                return self._send({'message': 'Search not found'}, status=404)
+            wait = re.match(r'wait=(\d+)', self.headers.get('Prefer', ''))
+            if wait:
+                deadline = time.monotonic() + int(wait.group(1))
+                while state.search_status(search)['status'] != 'COMPLETED' and time.monotonic() < deadline:
+                    time.sleep(0.05)
+            status = state.search_status(search)
+            if len(parts) == 4 and parts[3] == 'results':
+                if status['status'] != 'COMPLETED':
+                    return self._send({'message': 'Search not completed'}, status=404)
+                start, end = self._range(state.event_count)
+                events = [state.event(i) for i in range(start, end)]
+                # batched offense searches select one offense_<id> flag column per offense
+                flags = re.findall(r'AS offense_(\d+)', search['query'] or '')
+                for index, event in enumerate(events, start):
+                    for position, offense_id in enumerate(flags):
+                        event['offense_' + offense_id] = int(index % len(flags) == position)
+                return self._send({'events': events})
+            return self._send(status)
+        if parts[:2] == ['reference_data', 'sets'] and len(parts) == 3:
+            values = state.reference_sets.get(parts[2], [])
+            start, end = self._range(len(values))
+            return self._send({'name': parts[2], 'element_type': 'IP', 'number_of_elements': len(values),
+                               'data': [{'value': value, 'source': 'bench'} for value in values[start:end]]})
+        if path == 'reference_data/tables':
+            return self._paged([{'name': name, 'number_of_elements': len(table)}
+                                for name, table in state.reference_tables.items()])
+        if parts[:2] == ['reference_data', 'tables'] and len(parts) == 3:
+            table = state.reference_tables.get(parts[2], {})
+            keys = sorted(table)
+            start, end = self._range(len(keys))
+            data = {key: {inner: {'value': value} for inner, value in table[key].items()} for key in keys[start:end]}
+            return self._send({'name': parts[2], 'number_of_elements': len(keys), 'data': data})
+        if path == 'asset_model/properties':
+            return self._paged([{'id': i, 'name': 'Property {}'.format(i)} for i in range(50)])
+        if path == 'asset_model/assets':
+            return self._paged([{'id': i, 'domain_id': 0, 'padding': state.padding} for i in range(200)])
+        if path == 'forensics/case_management/cases':
+            return self._paged([{'id': i, 'name': 'Case {}'.format(i)} for i in range(20)])
+        return self._send({'message': 'Unknown endpoint {}'.format(path)}, status=404)
+
+    def route_post(self, path, query, body):
+        state = self.server_state
+        parts = self.path_parts
+        if path == 'ariel/searches':
+            search = {'id': str(uuid.uuid4()), 'created': time.monotonic(), 'query': query.get('query_expression')}
+            state.searches[search['id']] = search
+            return self._send(state.search_status(search), status=201)
+        if path.startswith('siem/offenses/') and path.endswith('/notes'):
+            return self._send({'id': 1, 'note_text': query.get('note_text')}, status=201)
+        if parts[:2] == ['siem', 'offenses'] and len(parts) == 3:
+            offense = state.offense(int(parts[2]))
+            offense.update({'status': query.get('status', 'OPEN'), 'closing_reason_id': query.get('closing_reason_id')})
+            return self._send(offense)
+        if parts[:3] == ['reference_data', 'sets', 'bulk_load']:
+            values = state.reference_sets.setdefault(parts[3], [])
+            existing = set(values)
+            values.extend(value for value in (body or []) if value not in existing)
+            return self._send({'name': parts[3], 'number_of_elements': len(values)})
+        if parts[:2] == ['reference_data', 'sets'] and len(parts) == 3:
+            values = state.reference_sets.setdefault(parts[2], [])
+            if query.get('value') not in values:
+                values.append(query.get('value'))
+            return self._send({'name': parts[2], 'number_of_elements': len(values)})
+        if parts[:3] == ['reference_data', 'tables', 'bulk_load']:
+            table = state.reference_tables.setdefault(parts[3], {})
+            for outer_key, inner in (body or {}).items():
+                table.setdefault(outer_key, {}).update(inner)
+            return self._send({'name': parts[3], 'number_of_elements': len(table)})
+        if parts[:2] == ['reference_data', 'tables'] and len(parts) == 3:
+            table = state.reference_tables.setdefault(parts[2], {})
+            table.setdefault(query.get('outer_key'), {})[query.get('inner_key')] = query.get('value')
+            return self._send({'name': parts[2], 'number_of_elements': len(table)})
+        if path == 'forensics/case_management/cases':
+            return self._send({'id': 100, 'name': (body or {}).get('name', 'Case')}, status=201)
+        if parts[:2] == ['asset_model', 'assets']:
+            return self._send('', status=202)
+        return self._send({'message': 'Unknown endpoint {}'.format(path)}, status=404)
+
+    def route_delete(self, path, query, body):
+        state = self.server_state
+        parts = self.path_parts
+        if parts[:2] == ['reference_data', 'sets'] and len(parts) == 4:
+            values = state.reference_sets.setdefault(parts[2], [])
+            if parts[3] in values:
+                values.remove(parts[3])
+            return self._send({'name': parts[2], 'number_of_elements': len(values)})
+        if parts[:2] == ['reference_data', 'tables'] and len(parts) == 5:
+            table = state.reference_tables.get(parts[2], {})
+            table.get(parts[3], {}).pop(parts[4], None)
+            return self._send({'name': parts[2], 'number_of_elements': len(table)})
+        if parts[:2] == ['reference_data', 'tables'] and len(parts) == 3:
+            return self._send({'id': 1, 'status': 'QUEUED', 'name': parts[2]}, status=202)
+        return self._send({'message': 'Unknown endpoint {}'.format(path)}, status=404)
+
+    def route_patch(self, path, query, body):
+        return self._send({'message': 'Unknown endpoint {}'.format(path)}, status=404)
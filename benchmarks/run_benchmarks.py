@@ -0,0 +1,190 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+# Times every operation in qradar.funcs.operations end-to-end against the local
+# fake QRadar server and reports p50/p95/p99 latency, throughput and peak RSS.
+#
+# Usage: python benchmarks/run_benchmarks.py [--iterations N] [--concurrency N]
+#            [--latency S] [--error-rate R] [--padding BYTES] [--rate-limit N]
+#            [--operations op1,op2] [--json]
+# Requires the FortiSOAR connector runtime (connectors.core) on the python path.
+import argparse
+import copy
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmarks.fake_qradar import FakeQRadar  # noqa: E402
+from qradar.funcs import operations  # noqa: E402
+
+OPERATION_PARAMS = {
+    'get_offenses': {'filter_string': 'status="OPEN"'},
+    'sync_offenses': {'filter_string': 'status="OPEN"', 'start_time': 0, 'page_size': 200, 'reset': True},
+    'query_qradar': {'search_string': 'select * from events last 5 minutes'},
+    'submit_ariel_search': {'search_string': 'select * from events last 5 minutes'},
+    'get_ariel_search_status': {},
+    'get_ariel_search_results': {'page_size': 200},
+    'get_events_related_to_offense': {'offense_id': 1, 'start_time': '2020-09-13T12:26:40.000Z',
+                                      'last_updated_time': '2020-09-13T13:26:40.000Z', 'max_results': 100},
+    'get_events_related_to_offenses': {'offense_ids': list(range(1, 51)), 'start_time': '2020-09-13T12:26:40.000Z',
+                                       'last_updated_time': '2020-09-13T13:26:40.000Z', 'max_results': 100},
+    'get_closing_reasons': {},
+    'close_offense': {'offense_id': 1, 'offense_close_id': 1, 'closure_note': 'Closed by benchmark'},
+    'close_offenses': {'offense_ids': list(range(1, 101)), 'offense_close_id': 1, 'closure_note': 'Closed by benchmark'},
+    'get_source_ip': {'source_address_ids': list(range(1, 251))},
+    'get_destination_ip': {'destination_address_ids': list(range(1, 251))},
+    'invoke_api': {'method': 'GET', 'endpoint': '/siem/offenses', 'request_parameters': {}, 'headers': {}},
+    'get_offense_type': {},
+    'get_metrics': {},
+    'handle_reference_set_value': {'method': 'Retrieves Value', 'name': 'bench_set'},
+    'sync_reference_set': {'name': 'bench_set', 'values': ['10.0.0.{}'.format(i) for i in range(200)],
+                           'remove_missing': False},
+    'add_notes': {'offense_id': 1, 'closure_note': 'Benchmark note'},
+    'add_notes_bulk': {'offense_ids': list(range(1, 101)), 'closure_note': 'Benchmark note'},
+    'get_notes': {'offense_id': 1},
+    'get_assets_properties': {'max_results': 50, 'filter_string': '', 'query.fields': ''},
+    'get_assets': {'filter_string': '', 'max_results': 100, 'query.fields': '', 'query.sort': ''},
+    'update_asset': {'path.asset_id': 1, 'body.asset': {'properties': []}, 'content_type': 'application/json'},
+    'get_cases': {'query.fields': '', 'filter_string': '', 'max_results': 20},
+    'create_case': {'body.case': {'name': 'Benchmark case'}, 'content_type': 'application/json'},
+    'get_reference_tables': {'filter_string': '', 'max_results': 10, 'query.fields': ''},
+    'delete_reference_table': {'path.name': 'bench_table', 'query.purge_only': 'true', 'query.fields': '',
+                               'query.namespace': ''},
+    'get_table_elements': {'path.name': 'bench_table', 'max_results': 100, 'query.fields': '',
+                           'query.namespace': ''},
+    'add_table_element': {'path.name': 'bench_table', 'query.outer_key': 'key1', 'query.inner_key': 'owner',
+                          'query.value': 'bench', 'query.domain_id': '', 'query.source': '', 'query.fields': '',
+                          'query.namespace': ''},
+    'bulk_load_table_elements': {'name': 'bench_table', 'batch_size': 500,
+                                 'elements': {'key{}'.format(i): {'owner': 'bench{}'.format(i)} for i in range(2000)}},
+    'delete_table_element': {'path.name': 'bench_table', 'path.outer_key': 'key1', 'path.inner_key': 'owner',
+                             'query.value': 'bench', 'query.domain_id': '', 'query.fields': '',
+                             'query.namespace': ''},
+}
+
+
+def completed_search(config):
+    """
+    Submits an Ariel search and waits for it to complete, for the operations that take a search ID
+    """
+    search = operations['submit_ariel_search'](config, {'search_string': 'select * from events last 5 minutes'})
+    operations['get_ariel_search_results'](config, {'search_id': search['search_id'], 'wait_for_completion': True,
+                                                    'max_rows': 1})
+    return {'search_id': search['search_id']}
+
+
+# Operations that need server side state first; the setup runs once, outside the timings,
+# and returns parameters that are added to those in OPERATION_PARAMS
+OPERATION_SETUP = {
+    'get_ariel_search_status': completed_search,
+    'get_ariel_search_results': completed_search,
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def run_operation(config, name, iterations, concurrency):
+    function = operations[name]
+    params = dict(OPERATION_PARAMS[name])
+    if name in OPERATION_SETUP:
+        params.update(OPERATION_SETUP[name](config))
+
+    def call(_):
+        call_params = copy.deepcopy(params)
+        call_params['operation'] = name
+        start = time.perf_counter()
+        try:
+            function(config, call_params)
+            return time.perf_counter() - start, None
+        except Exception as err:
+            return time.perf_counter() - start, str(err)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(call, range(iterations)))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latency, error in outcomes if error is None]
+    errors = [error for latency, error in outcomes if error is not None]
+    return {
+        'operation': name,
+        'calls': iterations,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'throughput': iterations / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the QRadar connector operations against a fake QRadar')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--padding', type=int, default=0, help='filler bytes added to every record')
+    parser.add_argument('--offenses', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--search-duration', type=float, default=0.5)
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='client side requests per second, 0 disables the connector rate limiter')
+    parser.add_argument('--operations', default='', help='comma separated subset of operations')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    fake = FakeQRadar(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      offense_count=args.offenses, event_count=args.events, padding=args.padding,
+                      search_duration=args.search_duration)
+    address = fake.start()
+    config = {'address': address, 'token': 'benchmark', 'api_version': '14.0', 'verify_ssl': False,
+              'rate_limit': args.rate_limit}
+    selected = [name.strip() for name in args.operations.split(',') if name.strip()] or list(operations)
+    results = []
+    try:
+        for name in selected:
+            if name not in OPERATION_PARAMS:
+                results.append({'operation': name, 'skipped': 'no benchmark parameters defined'})
+                continue
+            results.append(run_operation(config, name, args.iterations, args.concurrency))
+    finally:
+        fake.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('{0:<32} {1:>6} {2:>6} {3:>10} {4:>10} {5:>10} {6:>10} {7:>9}'.format(
+        'operation', 'calls', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'ops/s', 'rss MB'))
+    for result in results:
+        if 'skipped' in result:
+            print('{0:<32} skipped: {1}'.format(result['operation'], result['skipped']))
+            continue
+        print('{operation:<32} {calls:>6} {errors:>6} {p50_ms:>10.1f} {p95_ms:>10.1f} {p99_ms:>10.1f} '
+              '{throughput:>10.1f} {peak_rss_mb:>9.1f}'.format(**result))
+        if result['first_error']:
+            print('    first error: {}'.format(result['first_error']))
+    print('requests served by the fake QRadar: {}'.format(fake.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import asyncio
+import atexit
+import json
+import threading
+from collections import OrderedDict
+from time import monotonic, perf_counter
+from connectors.core.connector import get_logger, ConnectorError
+from .conn import QradarConnection, REQUEST_TIMEOUT
+from .metrics import instrumentation, normalize_endpoint
+from .retry import retry_budget
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = get_logger("qradar")
+
+
+class AsyncQradarConnection(object):
+    """
+    asyncio client mirroring the public QradarConnection methods. Requests share one
+    aiohttp connection pool and at most max_concurrency of them are in flight at a time;
+    by default this is the max_workers setting of the connector configuration.
+    Use it as an async context manager, or through run_sync() from synchronous code.
+    """
+
+    def __init__(self, address, token, verify_ssl=True, api_version='6.0', max_concurrency=None,
+                 **kwargs):
+        if aiohttp is None:
+            raise ConnectorError('The aiohttp package is required for AsyncQradarConnection')
+        # The synchronous connection normalises the configuration and provides the
+        # request building, retry policy and rate limiter shared with this client
+        self.sync = QradarConnection(address, token, verify_ssl=verify_ssl, api_version=api_version, **kwargs)
+        self.base_url = self.sync.base_url
+        self.max_concurrency = int(max_concurrency) if max_concurrency else self.sync.max_workers
+        self.log = logger
+        # Requests run on the event loop thread, so they are labelled with the operation that created the client
+        self.operation = instrumentation.current_operation
+        self._session = None
+        self._owns_session = True
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self.__ensureSession()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def createSession(self):
+        """
+        Creates an aiohttp session authenticated for this QRadar instance; must be called from a running event loop
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, ssl=None if self.sync.verify_ssl else False)
+        return aiohttp.ClientSession(connector=connector, headers=dict(self.sync.session.headers),
+                                     timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+    def useSession(self, session):
+        """
+        Sends the requests of this connection with a session shared with other connections, which close() leaves open
+        """
+        self._session = session
+        self._owns_session = False
+
+    def __ensureSession(self):
+        if self._session is None:
+            self._session = self.createSession()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+            self._session = None
+
+    async def __request(self, method, endpoint, params=None, headers=None, data=None, json_data=None,
+                        idempotent=None):
+        self.__ensureSession()
+        url = '{}/{}'.format(self.base_url, endpoint)
+        policy = self.sync.retry_policy
+        attempt = 0
+        started = perf_counter()
+        retry_budget.deposit()
+        async with self._semaphore:
+            while True:
+                wait = self.sync.rate_limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.log.debug('{0} to URL: {1}'.format(method, url))
+                try:
+                    async with self._session.request(method, url, params=params, headers=headers, data=data,
+                                                     json=json_data) as res:
+                        content = await res.read()
+                        status = res.status
+                        retry_after = res.headers.get('Retry-After')
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                    # as for the synchronous client, certificate errors and timeouts of the whole request are final
+                    if isinstance(err, (aiohttp.ClientSSLError, asyncio.TimeoutError)) or \
+                            not policy.is_retryable(method, attempt, idempotent=idempotent):
+                        self.__emitRequest(method, endpoint, started, attempt, type(err).__name__, data)
+                        raise ConnectorError('Request to {0} failed: {1}'.format(url, err))
+                    delay = policy.backoff(attempt)
+                else:
+                    if not policy.is_retryable(method, attempt, status_code=status, idempotent=idempotent):
+                        self.__emitRequest(method, endpoint, started, attempt, status, data, content)
+                        return self.__parseResult(status, content)
+                    delay = policy.backoff(attempt, retry_after)
+                attempt += 1
+                self.log.warning('Retrying {0} {1} in {2:.2f}s (attempt {3})'.format(method, url, delay, attempt))
+                await asyncio.sleep(delay)
+
+    def __emitRequest(self, method, endpoint, started, retries, status, data=None, content=None):
+        instrumentation.emit('request', method=method, endpoint=normalize_endpoint(endpoint), status=str(status),
+                             duration=perf_counter() - started, retries=retries,
+                             bytes_sent=len(data) if isinstance(data, (str, bytes)) else 0,
+                             bytes_received=len(content) if content else 0, operation=self.operation)
+
+    def __parseResult(self, status, content):
+        if status >= 400:
+            raise ConnectorError('Response from server: {}'.format(str(content)))
+        if not content:
+            return []
+        try:
+            return json.loads(content)
+        except ValueError:
+            return content
+
+    def __params(self, params):
+        # aiohttp only accepts str, int and float query values
+        return {key: str(value).lower() if isinstance(value, bool) else value
+                for key, value in (params or {}).items() if value is not None}
+
+    async def arielSearch(self, search_string, timeout=None, **kwargs):
+        res = await self.__request('POST', 'ariel/searches', params={'query_expression': search_string})
+        searchId = res.get('search_id')
+        await self.__waitForArielSearch(searchId, res, timeout=timeout)
+        return await self.__request('GET', 'ariel/searches/{}/results'.format(searchId))
+
+    async def __waitForArielSearch(self, searchId, search_status, timeout=None):
+        endpoint = 'ariel/searches/{}'.format(searchId)
+        timeout = float(timeout) if timeout else QradarConnection.MAX_ALLOW_SEARCH_SECS
+        deadline = monotonic() + timeout
+        interval = QradarConnection.ARIEL_POLL_MIN_INTERVAL
+        while True:
+            status = search_status.get('status', '').lower()
+            if status == 'completed':
+                return search_status
+            elif status in ['canceled', 'error']:
+                raise ConnectorError('Ariel search {0} ended with status {1}: {2}'.format(
+                    searchId, status.upper(), search_status.get('error_messages', '')))
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise RuntimeError('Search took longer than {} seconds to complete so we quit trying.'.format(timeout))
+            interval = self.sync.nextPollInterval(search_status, interval)
+            await asyncio.sleep(min(interval, remaining))
+            search_status = await self.__request('GET', endpoint)
+
+    async def getOffenses(self, filter_string, fields=None, sort=None, **kwargs):
+        params = {'filter': filter_string, 'fields': fields or None, 'sort': sort or None}
+        return await self.__request('GET', 'siem/offenses', params=self.__params(params))
+
+    async def getEventsRelatedToOffense(self, offense_id, start_time, end_time, result_limit=100, timeout=None,
+                                        **kwargs):
+        searchString = "select * from events where InOffense({}) limit {} start '{}' stop '{}'".format(
+            offense_id, result_limit, start_time, end_time)
+        return await self.arielSearch(searchString, timeout=timeout)
+
+    async def closeOffense(self, offense_id, offense_close_id, closure_note=None, **kwargs):
+        if closure_note:
+            await self.addNote(offense_id, closure_note=closure_note)
+        params = {"closing_reason_id": offense_close_id, "status": "CLOSED"}
+        return await self.__request('POST', 'siem/offenses/{}'.format(offense_id), params=self.__params(params),
+                                    idempotent=True)
+
+    async def addNote(self, offense_id, closure_note=None, **kwargs):
+        return await self.__request('POST', 'siem/offenses/{}/notes'.format(offense_id),
+                                    params={'note_text': closure_note})
+
+    async def getNote(self, offense_id, **kwargs):
+        return await self.__request('GET', 'siem/offenses/{}/notes'.format(offense_id))
+
+    async def get_closing_reasons(self):
+        return await self.__request('GET', 'siem/offense_closing_reasons')
+
+    async def get_offense_type(self):
+        return await self.__request('GET', 'siem/offense_types')
+
+    async def get_address_details(self, endpoint, ips, params_fields):
+        chunk = 100  # limit of send ips to GET request
+        ids = list(OrderedDict.fromkeys(str(ip).strip() for ip in ips))
+        pages = await asyncio.gather(*[
+            self.__request('GET', endpoint, params={'filter': 'id in (' + ",".join(ids[start:start + chunk]) + ')',
+                                                    'fields': params_fields})
+            for start in range(0, len(ids), chunk)])
+        result = []
+        for res in pages:
+            result += res
+        return result
+
+    async def getSourceIpAddresses(self, ips, **kwargs):
+        return await self.get_address_details('siem/source_addresses', ips, 'id, source_ip, network, magnitude')
+
+    async def getDestinationIPAddresses(self, ips, **kwargs):
+        return await self.get_address_details('siem/local_destination_addresses', ips,
+                                              'id, local_destination_ip, network, magnitude')
+
+    async def invokeQRadarAPI(self, method, endpoint, params, headers, data=None):
+        if method.lower() not in ['get', 'post', 'patch', 'delete']:
+            raise ConnectorError('Unsupported request method')
+        return await self.__request(method.upper(), endpoint.lstrip('/'), params=self.__params(params),
+                                    headers=headers, data=data or None)
+
+    async def get_record(self, params):
+        endpoint, url_params, headers, data = self.sync.build_request(params)
+        return await self.__request('GET', endpoint, params=self.__params(url_params), headers=headers)
+
+    async def update_record(self, params):
+        endpoint, url_params, headers, data = self.sync.build_request(params)
+        return await self.__request('POST', endpoint, params=self.__params(url_params), headers=headers,
+                                    json_data=data)
+
+    async def delete_record(self, params):
+        endpoint, url_params, headers, data = self.sync.build_request(params)
+        return await self.__request('DELETE', endpoint, params=self.__params(url_params), headers=headers)
+
+
+_loop = None
+_loop_lock = threading.Lock()
+# aiohttp sessions shared by run_sync() calls, per QRadar instance; only used from the loop thread
+_sessions = {}
+
+
+def is_available():
+    return aiohttp is not None
+
+
+def _get_loop():
+    """
+    Returns the event loop run_sync() schedules its calls on, running in a background thread
+    for the lifetime of the process so that sessions and their connections outlive each call
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='qradar-async', daemon=True).start()
+            atexit.register(_close_sessions)
+        return _loop
+
+
+def _close_sessions():
+    async def close():
+        while _sessions:
+            await _sessions.popitem()[1].close()
+    try:
+        asyncio.run_coroutine_threadsafe(close(), _loop).result(timeout=5)
+    except Exception as err:
+        logger.warning('Could not close the aiohttp sessions: {}'.format(err))
+
+
+def run_sync(config, call):
+    """
+    Synchronous facade for funcs operations: awaits call(connection) on an AsyncQradarConnection
+    for config. Calls from any thread run on one shared event loop and reuse the aiohttp session
+    of the QRadar instance, so concurrent operations share its connection pool.
+    :param config: connector configuration
+    :param call: coroutine function taking the connection, e.g. lambda q: q.getSourceIpAddresses(ids)
+    :return: result of the call
+    """
+    connection = AsyncQradarConnection(**config)
+
+    # the pool of a session is sized for max_concurrency, so each setting gets its own session
+    key = (connection.sync.instance_key, connection.max_concurrency)
+
+    async def runner():
+        session = _sessions.get(key)
+        if session is None or session.closed:
+            session = _sessions[key] = connection.createSession()
+        connection.useSession(session)
+        return await call(connection)
+    return asyncio.run_coroutine_threadsafe(runner(), _get_loop()).result()
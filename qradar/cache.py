@@ -0,0 +1,267 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from .state import CACHE_DIR, atomic_write_json, locked, read_json
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_SIZE = 256
+
+ARIEL_CACHE_DIR = os.path.join(CACHE_DIR, 'ariel_cache')
+ARIEL_CACHE_MAX_AGE = 24 * 3600
+ARIEL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# searches older than this are assumed to have expired on QRadar and are not re-attached
+ARIEL_IN_FLIGHT_MAX_AGE = 600
+# QRadar interprets START/STOP in the console time zone, which may be up to 14 hours ahead of UTC
+ARIEL_STOP_MARGIN = 14 * 3600
+
+
+class TTLCache(object):
+    """
+    Thread safe in-process cache with per entry expiry and LRU eviction once max_size is reached
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Returns the cached value for key, calling loader() and caching its result on a miss
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = loader()
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def invalidate(self, predicate=None):
+        """
+        Drops every entry, or only those whose key matches predicate(key)
+        :return: number of entries removed
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class ArielResultCache(object):
+    """
+    On-disk cache of Ariel search results, keyed by the normalized AQL text. Searches with an
+    absolute START/STOP window get a key: identical concurrent queries re-attach to the running
+    search recorded under it instead of creating a duplicate, and once the window lies in the
+    past (see cacheable) the results are cached, since they can no longer change. Queries using
+    LAST n MINUTES or NOW() always run.
+    """
+    QUOTED = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+    RELATIVE_TIME = re.compile(r"\blast\s+\d+\s+(second|minute|hour|day|week)s?\b|\bnow\s*\(", re.IGNORECASE)
+    ABSOLUTE_WINDOW = re.compile(r"\bstart\s+('[^']*'|\d+)\s+stop\s+('[^']*'|\d+)", re.IGNORECASE)
+    TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y/%m/%d-%H:%M:%S')
+
+    def __init__(self, directory=ARIEL_CACHE_DIR, max_age=ARIEL_CACHE_MAX_AGE, max_bytes=ARIEL_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def normalize(cls, search_string):
+        """
+        Collapses whitespace and lower-cases the AQL outside of quoted strings and identifiers
+        """
+        parts = cls.QUOTED.split(search_string.strip().rstrip(';'))
+        return ''.join(part if index % 2 else re.sub(r'\s+', ' ', part).lower()
+                       for index, part in enumerate(parts)).strip()
+
+    @classmethod
+    def _parse_time(cls, value):
+        value = value.strip("'").strip()
+        if value.isdigit():
+            return int(value) / 1000.0
+        for time_format in cls.TIME_FORMATS:
+            try:
+                return datetime.strptime(value, time_format).replace(tzinfo=timezone.utc).timestamp()
+            except ValueError:
+                continue
+        return None
+
+    @classmethod
+    def _window(cls, normalized):
+        if cls.RELATIVE_TIME.search(normalized):
+            return None
+        return cls.ABSOLUTE_WINDOW.search(normalized)
+
+    def key(self, instance_key, search_string, max_rows=None):
+        """
+        :return: key of a search over an absolute time window, or None when its window is relative
+        """
+        normalized = self.normalize(search_string)
+        if not self._window(normalized):
+            return None
+        payload = json.dumps([list(instance_key), normalized, int(max_rows) if max_rows else None])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def cacheable(self, search_string):
+        """
+        :return: whether the results of a search can be cached, i.e. its absolute window has closed
+        """
+        window = self._window(self.normalize(search_string))
+        stop = self._parse_time(window.group(2)) if window else None
+        return stop is not None and stop + ARIEL_STOP_MARGIN <= time.time()
+
+    def _path(self, key, suffix='.json'):
+        return os.path.join(self.directory, key + suffix)
+
+    def lock(self, key):
+        return locked(self._path(key, '.search'))
+
+    def get(self, key):
+        path = self._path(key)
+        entry = read_json(path)
+        if entry is None or time.time() - entry.get('created', 0) > self.max_age:
+            self.misses += 1
+            return None
+        try:
+            # the modification time orders entries for size based eviction
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return entry['results']
+
+    def set(self, key, search_string, results):
+        atomic_write_json(self._path(key), {'query': search_string, 'created': time.time(), 'results': results})
+        self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the cache fits in max_bytes,
+        and forgets the searches that are no longer running
+        :return: number of entries removed
+        """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        self.__pruneSearches(names)
+        for name in names:
+            if not name.endswith('.json') or name.startswith('.'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        now = time.time()
+        total = sum(size for mtime, size, path in entries)
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self.evictions += removed
+        return removed
+
+    def in_flight(self, key):
+        """
+        :return: the running search recorded for key, as a dict with its search_id, or None
+        """
+        search = read_json(self._path(key, '.search'))
+        if not search or time.time() - search.get('created', 0) > ARIEL_IN_FLIGHT_MAX_AGE:
+            return None
+        return search
+
+    def register(self, key, search_id):
+        atomic_write_json(self._path(key, '.search'), {'search_id': search_id, 'created': time.time()})
+
+    def release(self, key, search_id):
+        """
+        Forgets the search recorded for key once it finished, along with its lock file
+        """
+        with locked(self._path(key, '.search'), remove=True):
+            search = read_json(self._path(key, '.search'))
+            if search and search.get('search_id') == search_id:
+                self.__remove(self._path(key, '.search'))
+        self.evict()
+
+    def __pruneSearches(self, names):
+        # searches whose process died before release() leave their record and lock file behind
+        suffixes = ('.search', '.search.lock')
+        keys = set(name[:-len(suffix)] for name in names for suffix in suffixes if name.endswith(suffix))
+        for key in keys:
+            path = self._path(key, '.search')
+            with locked(path, remove=True):
+                if self.in_flight(key) is None:
+                    self.__remove(path)
+
+    @staticmethod
+    def __remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+lookup_cache = TTLCache()
+ariel_result_cache = ArielResultCache()
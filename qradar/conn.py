@@ -4,19 +4,49 @@
   FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
   Copyright end """
 import requests
+import copy
+import hashlib
 import json
-from time import sleep
+import logging
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, monotonic, perf_counter, time
+from urllib.parse import quote
 from connectors.core.connector import get_logger, ConnectorError
 from requests_toolbelt.utils import dump
+from .pool import session_registry, SessionRegistry
+from .cache import lookup_cache, ariel_result_cache
+from .metrics import instrumentation, metrics_registry, normalize_endpoint
+from .state import STATE_DIR, atomic_write_json, locked, read_json
+from .retry import RetryPolicy, retry_budget, get_rate_limiter, DEFAULT_RATE_LIMIT, DEFAULT_RATE_LIMIT_BURST
+from .utils import decode_response, truncate_body, LOG_BODY_LIMIT
 
 logger = get_logger("qradar")
 
+metrics_registry.register_collector('session_pool', session_registry.stats)
+metrics_registry.register_collector('lookup_cache', lookup_cache.stats)
+metrics_registry.register_collector('ariel_result_cache', ariel_result_cache.stats)
+
 REQUEST_TIMEOUT = 600
+CONNECT_TIMEOUT = 30
 
 
 class QradarConnection(object):
     MAX_ALLOW_SEARCH_SECS = 600
+    ARIEL_POLL_MIN_INTERVAL = 0.25
+    ARIEL_POLL_MAX_INTERVAL = 10
+    ARIEL_POLL_BACKOFF = 2
+    ARIEL_LONG_POLL_SECS = 0
+    ARIEL_LONG_POLL_MAX_SECS = 60
+    ARIEL_RESULTS_PAGE_SIZE = 1000
     MAX_RESULTS = 100
+    PAGE_SIZE = 500
+    MAX_WORKERS = 4
+    BULK_BATCH_SIZE = 1000
+    REFERENCE_DATA_PAGE_SIZE = 5000
+    OFFENSE_SEARCH_GROUP_SIZE = 10
     endpoints = {
         'get_assets_properties': 'asset_model/properties',
         'get_assets': 'asset_model/assets',
@@ -39,86 +69,372 @@ class QradarConnection(object):
         self.api_version = api_version
         self.base_url = '{}/api'.format(self.address)
         self.log = logger
-        self.__genSession()
-
-    def __genSession(self):
-        self.log.debug('Creating Session')
-        self.session = requests.Session()
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'SEC': self.token,
-            'Version': str(self.api_version),
-        }
-        self.session.headers.update(headers)
-        self.session.verify = self.verify_ssl
+        self.log_body_limit = self.__option(kwargs, 'log_body_limit', LOG_BODY_LIMIT, int)
+        self.max_workers = self.__option(kwargs, 'max_workers', self.MAX_WORKERS, int) or self.MAX_WORKERS
+        self.instance_key = SessionRegistry.make_key(self.address, token, verify_ssl, api_version)
+        self.lookup_cache_ttl = self.__option(kwargs, 'lookup_cache_ttl', None, float)
+        self.retry_policy = RetryPolicy(max_retries=self.__option(kwargs, 'max_retries', 3, int),
+                                        backoff_factor=self.__option(kwargs, 'retry_backoff', 0.5, float),
+                                        budget=retry_budget)
+        self.rate_limiter = get_rate_limiter(
+            self.instance_key, rate=self.__option(kwargs, 'rate_limit', DEFAULT_RATE_LIMIT, float),
+            capacity=self.__option(kwargs, 'rate_limit_burst', DEFAULT_RATE_LIMIT_BURST, float))
+        self.__genSession(pool_size=self.__option(kwargs, 'pool_size', None, int),
+                          pool_idle_timeout=self.__option(kwargs, 'pool_idle_timeout', None, float),
+                          pool_max_age=self.__option(kwargs, 'pool_max_age', None, float))
+
+    @staticmethod
+    def __option(kwargs, name, default, cast):
+        """
+        Reads an optional numeric setting of the connector configuration, which the UI sends as
+        an empty value when it is left blank
+        """
+        value = kwargs.get(name)
+        if value is None or value == '':
+            return default
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            raise ConnectorError('Invalid value for {0}: {1}'.format(name, value))
+
+    def __genSession(self, pool_size=None, pool_idle_timeout=None, pool_max_age=None):
+        self.log.debug('Acquiring pooled session')
+        self.session = session_registry.get_session(self.address, self.token, verify_ssl=self.verify_ssl,
+                                                    api_version=self.api_version, pool_size=pool_size,
+                                                    idle_timeout=pool_idle_timeout, max_age=pool_max_age)
+        self.log.debug('Session pool stats: {}'.format(session_registry.stats()))
 
     def __parseRequestResult(self, results):
         if not results.ok:
             raise ConnectorError('Response from server: {}'.format(str(results.content)))
         self.log.debug('Parsing request return data')
         self.log.debug('Return Status Code: {}'.format(results.status_code))
-        self.log.debug('Return Text: {}'.format(results.text))
-        if len(results.text) > 0:
-            if results.status_code in [200, 201, 202, 204]:
-                try:
-                    json.loads(results.content)
-                    self.log.debug('Returning assumed json.')
-                    return results.json()
-                except ValueError as e:
-                    self.log.debug('Returning assumed text.')
-                    return results.content
-        else:
-            self.log.warning('Warning returning empty list... ')
-            return []
+        if results.status_code in [200, 201, 202, 204, 206]:
+            started = perf_counter()
+            parsed = decode_response(results)
+            instrumentation.emit('decode', duration=perf_counter() - started, bytes=len(results.content))
+            if parsed is None:
+                self.log.warning('Warning returning empty list... ')
+                return []
+            self.log.debug('Returning assumed {}.'.format('text' if isinstance(parsed, bytes) else 'json'))
+            return parsed
 
-    def __postUrl(self, endpoint, params={}, headers={}, data={}, json={}):
+    def __logResponse(self, res):
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>:\n{0}\n'.format(
+                truncate_body(dump.dump_all(res), self.log_body_limit)))
+
+    def __send(self, method, endpoint, idempotent=None, **kwargs):
+        """
+        Sends a request, retrying it according to the connection retry policy
+        :param idempotent: overrides whether the request is safe to repeat, e.g. True for a POST that sets a state
+        :return: requests.Response
+        """
         url = '{}/{}'.format(self.base_url, endpoint)
-        self.log.debug('POST to URL: {}'.format(url))
-        res = self.session.post(url, params=params, headers=headers, data=data, json=json, timeout=REQUEST_TIMEOUT)
-        logger.debug('\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>:\n{0}\n'.format(dump.dump_all(res).decode('utf-8')))
-        return self.__parseRequestResult(res)
+        attempt = 0
+        started = perf_counter()
+        retry_budget.deposit()
+        while True:
+            self.rate_limiter.acquire()
+            self.log.debug('{0} to URL: {1}'.format(method, url))
+            try:
+                res = self.session.request(method, url, timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT), **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                if not self.retry_policy.is_retryable(method, attempt, idempotent=idempotent, error=err):
+                    self.__emitRequest(method, endpoint, started, attempt, type(err).__name__)
+                    raise
+                delay = self.retry_policy.backoff(attempt)
+                reason = str(err)
+            else:
+                self.__logResponse(res)
+                if not self.retry_policy.is_retryable(method, attempt, status_code=res.status_code,
+                                                      idempotent=idempotent):
+                    self.__emitRequest(method, endpoint, started, attempt, res.status_code, res)
+                    return res
+                delay = self.retry_policy.backoff(attempt, res.headers.get('Retry-After'))
+                reason = 'status code {}'.format(res.status_code)
+            attempt += 1
+            self.log.warning('Retrying {0} {1} in {2:.2f}s (attempt {3}) after {4}'.format(
+                method, url, delay, attempt, reason))
+            sleep(delay)
+
+    def __emitRequest(self, method, endpoint, started, retries, status, res=None):
+        body = res.request.body if res is not None else None
+        instrumentation.emit('request', method=method, endpoint=normalize_endpoint(endpoint), status=str(status),
+                             duration=perf_counter() - started, retries=retries,
+                             bytes_sent=len(body) if body else 0,
+                             bytes_received=len(res.content) if res is not None else 0)
+
+    def __request(self, method, endpoint, **kwargs):
+        return self.__parseRequestResult(self.__send(method, endpoint, **kwargs))
+
+    def __postUrl(self, endpoint, params={}, headers={}, data={}, json={}, idempotent=None):
+        return self.__request('POST', endpoint, params=params, headers=headers, data=data, json=json,
+                              idempotent=idempotent)
 
     def __patchUrl(self, endpoint, params={}, headers={}, data={}):
-        url = '{}/{}'.format(self.base_url, endpoint)
-        self.log.debug('PATCH to URL: {}'.format(url))
-        res = self.session.patch(url, params=params, headers=headers, data=data, timeout=REQUEST_TIMEOUT)
-        logger.debug('\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>:\n{0}\n'.format(dump.dump_all(res).decode('utf-8')))
-        return self.__parseRequestResult(res)
+        return self.__request('PATCH', endpoint, params=params, headers=headers, data=data)
 
     def __getUrl(self, endpoint, params={}, headers={}):
-        url = '{}/{}'.format(self.base_url, endpoint)
-        self.log.debug('GET to URL: {}'.format(url))
-        res = self.session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
-        logger.debug('\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>:\n{0}\n'.format(dump.dump_all(res).decode('utf-8')))
-        return self.__parseRequestResult(res)
+        return self.__request('GET', endpoint, params=params, headers=headers)
 
     def __deleteUrl(self, endpoint, params={}, headers={}, data={}):
-        url = '{}/{}'.format(self.base_url, endpoint)
-        self.log.debug('GET to URL: {}'.format(url))
-        res = self.session.delete(url, params=params, headers=headers, data=data, timeout=REQUEST_TIMEOUT)
-        logger.debug('\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>:\n{0}\n'.format(dump.dump_all(res).decode('utf-8')))
-        return self.__parseRequestResult(res)
+        return self.__request('DELETE', endpoint, params=params, headers=headers, data=data)
+
+    def __iterRange(self, endpoint, params=None, page_size=None, max_items=None, extract=None):
+        """
+        Walks a list endpoint in Range: items=x-y windows, stopping at the total
+        reported in the Content-Range response header
+        :param endpoint: list endpoint, e.g. siem/offenses
+        :param params: query parameters sent with every page
+        :param page_size: number of items requested per page
+        :param max_items: overall cap on the number of items returned
+        :param extract: returns the items of a page from the response, e.g. the data of a reference set
+        :return: generator of item lists, one per page
+        """
+        page_size = int(page_size) if page_size else self.PAGE_SIZE
+        limit = int(max_items) if max_items else None
+        start = 0
+        while limit is None or start < limit:
+            end = start + page_size - 1
+            if limit is not None:
+                end = min(end, limit - 1)
+            res = self.__send('GET', endpoint, params=params, headers={'Range': 'items={0}-{1}'.format(start, end)})
+            parsed = self.__parseRequestResult(res)
+            items = extract(parsed) if extract else parsed
+            if not items:
+                break
+            yield items
+            total = self.__contentRangeTotal(res)
+            if total is None and isinstance(parsed, dict):
+                # reference data collections report their size in the body instead
+                total = parsed.get('number_of_elements')
+            if len(items) < end - start + 1 or (total is not None and end + 1 >= total):
+                break
+            start = end + 1
+
+    def __contentRangeTotal(self, res):
+        # Content-Range: items 0-49/1234
+        match = re.search(r'/(\d+)\s*$', res.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else None
+
+    def nextPollInterval(self, search_status, interval):
+        """
+        Estimates how long to wait before polling an Ariel search again. When QRadar reports
+        progress the remaining execution time is extrapolated from it, otherwise backs off exponentially.
+        :param search_status: ariel/searches/{search_id} response
+        :param interval: previous poll interval in seconds
+        :return: next poll interval in seconds
+        """
+        progress = search_status.get('progress') or 0
+        execution_ms = search_status.get('query_execution_time') or 0
+        if 0 < progress < 100 and execution_ms:
+            remaining = (execution_ms / 1000.0) * (100 - progress) / progress
+            interval = remaining / 2
+        else:
+            interval = interval * self.ARIEL_POLL_BACKOFF
+        return max(self.ARIEL_POLL_MIN_INTERVAL, min(interval, self.ARIEL_POLL_MAX_INTERVAL))
 
-    def __getArielResults(self, searchId):
+    def __waitForArielSearch(self, searchId, search_status=None, timeout=None, long_poll=None):
+        """
+        Polls an Ariel search until it completes
+        :param searchId: Ariel search ID
+        :param search_status: last known search status, e.g. the response of the search creation
+        :param timeout: seconds to wait before giving up, defaults to MAX_ALLOW_SEARCH_SECS
+        :param long_poll: seconds QRadar may hold each status request open (Prefer: wait=N), 0 disables it
+        :return: completed search status
+        """
         endpoint = 'ariel/searches/{}'.format(searchId)
-        totalSearchTime = 0
+        timeout = float(timeout) if timeout else self.MAX_ALLOW_SEARCH_SECS
+        long_poll = self.ARIEL_LONG_POLL_SECS if long_poll is None else int(long_poll)
+        started = monotonic()
+        deadline = started + timeout
+        interval = self.ARIEL_POLL_MIN_INTERVAL
+        waited = None
         while True:
-            res = self.__getUrl(endpoint)
-            status = res.get('status', '').lower()
-            if status == 'completed':
-                break
-            elif totalSearchTime >= self.MAX_ALLOW_SEARCH_SECS:
-                msg = 'Search took longer than {} seconds to complete so we quit trying.'.format(
-                    self.MAX_ALLOW_SEARCH_SECS)
+            if search_status:
+                status = search_status.get('status', '').lower()
+                if status == 'completed':
+                    wait = monotonic() - started
+                    execution = (search_status.get('query_execution_time') or 0) / 1000.0
+                    instrumentation.emit('ariel_search', search_id=searchId, wait=wait, execution=execution,
+                                         queue=max(0.0, wait - execution),
+                                         record_count=search_status.get('record_count'))
+                    return search_status
+                elif status in ['canceled', 'error']:
+                    msg = 'Ariel search {0} ended with status {1}: {2}'.format(
+                        searchId, status.upper(), search_status.get('error_messages', ''))
+                    self.log.error(msg)
+                    raise ConnectorError(msg)
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                msg = 'Search took longer than {} seconds to complete so we quit trying.'.format(timeout)
                 self.log.error(msg)
                 raise RuntimeError(msg)
-            totalSearchTime += 10
-            self.log.debug('Waiting for search results: total search time {}'.format(totalSearchTime))
-            sleep(10)
-        endpoint = '{}/results'.format(endpoint)
+            headers = {}
+            wait = 0
+            if long_poll > 0:
+                wait = max(1, min(long_poll, self.ARIEL_LONG_POLL_MAX_SECS, int(remaining)))
+                headers['Prefer'] = 'wait={}'.format(wait)
+            # A long poll that came back early without completing means QRadar did not honour
+            # Prefer: wait, so pace the next request like a regular poll
+            if search_status and (long_poll <= 0 or (waited is not None and waited[1] < waited[0])):
+                interval = self.nextPollInterval(search_status, interval)
+                self.log.debug('Waiting {0:.2f}s for search {1}, progress {2}%'.format(
+                    interval, searchId, search_status.get('progress', 0)))
+                sleep(min(interval, remaining))
+            polled = monotonic()
+            search_status = self.__getUrl(endpoint, headers=headers)
+            waited = (wait, monotonic() - polled) if wait else None
+
+    def __getArielResults(self, searchId, search_status=None, timeout=None, long_poll=None, page_size=None,
+                          max_rows=None):
+        search_status = self.__waitForArielSearch(searchId, search_status=search_status, timeout=timeout,
+                                                  long_poll=long_poll)
+        if page_size or max_rows:
+            results = {}
+            for result_key, rows in self.__iterArielPages(searchId, search_status, page_size, max_rows):
+                results.setdefault(result_key, []).extend(rows)
+            if not results:
+                results[self.__arielResultKey(searchId, search_status)] = []
+            return results
+        endpoint = 'ariel/searches/{}/results'.format(searchId)
         return self.__getUrl(endpoint)
 
+    def __arielResultKey(self, searchId, search_status):
+        """
+        Asks QRadar for the key the results of a search are returned under, 'events' or 'flows'
+        :param search_status: completed search status, used for its record_count
+        """
+        endpoint = 'ariel/searches/{}/results'.format(searchId)
+        headers = {'Range': 'items=0-0'} if search_status.get('record_count') else {}
+        res = self.__getUrl(endpoint, headers=headers)
+        return next(iter(res), 'events') if isinstance(res, dict) else 'events'
+
+    def __iterArielPages(self, searchId, search_status, page_size=None, max_rows=None, start=0):
+        """
+        Walks the results of a completed Ariel search in Range windows
+        :param search_status: completed search status, used for its record_count
+        :param page_size: number of records requested per page
+        :param max_rows: overall cap on the number of records returned
+        :param start: index of the first record to return
+        :return: generator of (result key, records) tuples, e.g. ('events', [...])
+        """
+        endpoint = 'ariel/searches/{}/results'.format(searchId)
+        page_size = int(page_size) if page_size else self.ARIEL_RESULTS_PAGE_SIZE
+        start = int(start or 0)
+        total = search_status.get('record_count')
+        if max_rows:
+            total = min(total, start + int(max_rows)) if total is not None else start + int(max_rows)
+        while total is None or start < total:
+            end = start + page_size - 1
+            if total is not None:
+                end = min(end, total - 1)
+            self.log.debug('Fetching results {0}-{1} of search {2}'.format(start, end, searchId))
+            page = self.__getUrl(endpoint, headers={'Range': 'items={0}-{1}'.format(start, end)})
+            if not page:
+                break
+            result_key, rows = next(iter(page.items()))
+            if rows:
+                yield result_key, rows
+            if len(rows) < end - start + 1:
+                break
+            start = end + 1
+
+    def iterArielResults(self, searchId, search_status=None, page_size=None, max_rows=None, timeout=None,
+                         long_poll=None):
+        """
+        Streams the records of an Ariel search page by page, waiting for the search to complete first
+        :param searchId: Ariel search ID
+        :param page_size: number of records requested per page
+        :param max_rows: overall cap on the number of records returned
+        :return: generator of result records
+        """
+        search_status = self.__waitForArielSearch(searchId, search_status=search_status, timeout=timeout,
+                                                  long_poll=long_poll)
+        for result_key, rows in self.__iterArielPages(searchId, search_status, page_size, max_rows):
+            for row in rows:
+                yield row
+
+    def submitArielSearch(self, search_string, reuse_running=False):
+        """
+        Creates an Ariel search without waiting for it to complete
+        :param reuse_running: return the identical search that is still running, if any, instead of
+                              creating another one; only applies to searches over an absolute time window
+        :return: search status, including the search_id used to collect the results later
+        """
+        key = ariel_result_cache.key(self.instance_key, search_string) if reuse_running else None
+        if key is None:
+            searchId, res = self.__createArielSearch(search_string)
+        else:
+            searchId, res = self.__attachArielSearch(key, search_string)
+        return res
+
+    def getArielSearchStatus(self, searchId, wait=None):
+        """
+        :param searchId: Ariel search ID
+        :param wait: seconds QRadar may hold the request open until the search completes
+        :return: search status
+        """
+        headers = {}
+        if wait:
+            headers['Prefer'] = 'wait={}'.format(max(1, min(int(wait), self.ARIEL_LONG_POLL_MAX_SECS)))
+        return self.__getUrl('ariel/searches/{}'.format(quote(str(searchId), safe='')), headers=headers)
+
+    def getArielSearchResults(self, searchId, start=0, page_size=None, max_rows=None, wait=False, timeout=None,
+                              long_poll=None):
+        """
+        Collects one window of the results of an existing Ariel search
+        :param searchId: Ariel search ID, e.g. returned by submitArielSearch
+        :param start: index of the first record to return
+        :param page_size: number of records requested per request
+        :param max_rows: number of records to return, defaults to all remaining records
+        :param wait: wait for a running search to complete instead of returning its status
+        :return: search status and, once completed, the records with the offset of the next window
+        """
+        searchId = quote(str(searchId), safe='')
+        if wait:
+            search_status = self.__waitForArielSearch(searchId, timeout=timeout, long_poll=long_poll)
+        else:
+            search_status = self.getArielSearchStatus(searchId)
+            status = search_status.get('status', '').upper()
+            if status in ['CANCELED', 'ERROR']:
+                raise ConnectorError('Ariel search {0} ended with status {1}: {2}'.format(
+                    searchId, status, search_status.get('error_messages', '')))
+            if status != 'COMPLETED':
+                return dict(search_status, completed=False)
+        start = int(start or 0)
+        result = {'search_id': search_status.get('search_id', searchId), 'status': search_status.get('status'),
+                  'completed': True, 'record_count': search_status.get('record_count'), 'offset': start}
+        rows = []
+        for result_key, page in self.__iterArielPages(searchId, search_status, page_size, max_rows, start=start):
+            result.setdefault(result_key, rows).extend(page)
+        if not rows:
+            result[self.__arielResultKey(searchId, search_status)] = rows
+        next_offset = start + len(rows)
+        total = search_status.get('record_count')
+        result['next_offset'] = next_offset if total is not None and next_offset < total else None
+        return result
+
+    def __getCached(self, endpoint, params=None, headers=None):
+        """
+        GET for near static lookup endpoints, served from the shared lookup cache of this QRadar instance
+        """
+        key = (self.instance_key, endpoint, json.dumps(params or {}, sort_keys=True),
+               json.dumps(headers or {}, sort_keys=True))
+        res = lookup_cache.get_or_load(key, lambda: self.__getUrl(endpoint, params=params or {},
+                                                                  headers=headers or {}),
+                                       ttl=self.lookup_cache_ttl)
+        self.log.debug('Lookup cache stats: {}'.format(lookup_cache.stats()))
+        return copy.deepcopy(res)
+
+    def invalidateLookupCache(self, endpoint=None):
+        """
+        Drops the cached lookups of this QRadar instance, all of them or only those of one endpoint
+        :return: number of entries removed
+        """
+        return lookup_cache.invalidate(lambda key: key[0] == self.instance_key and endpoint in (None, key[1]))
+
     def __ensureStr(self, variable):
         if isinstance(variable, str):
             return variable
@@ -170,7 +486,65 @@ class QradarConnection(object):
             logger.error('Invalid credentials')
             raise ConnectorError('Invalid credentials')
 
-    def arielSearch(self, search_string, **kwargs):
+    def arielSearch(self, search_string, timeout=None, long_poll=None, page_size=None, max_rows=None,
+                    use_cache=False, **kwargs):
+        """
+        Runs an Ariel search and returns its results
+        :param use_cache: wait for an identical running search over an absolute time window instead of
+                          creating one, and serve such searches from the on-disk result cache once the
+                          window has passed
+        """
+        key = ariel_result_cache.key(self.instance_key, search_string, max_rows) if use_cache else None
+        if key is None:
+            searchId, res = self.__createArielSearch(search_string)
+            return self.__getArielResults(searchId, search_status=res, timeout=timeout, long_poll=long_poll,
+                                          page_size=page_size, max_rows=max_rows)
+        cacheable = ariel_result_cache.cacheable(search_string)
+        results = ariel_result_cache.get(key) if cacheable else None
+        if results is not None:
+            self.log.debug('Returning cached results of search: {}'.format(search_string))
+            return results
+        searchId, res = self.__attachArielSearch(key, search_string)
+        try:
+            results = self.__getArielResults(searchId, search_status=res, timeout=timeout, long_poll=long_poll,
+                                             page_size=page_size, max_rows=max_rows)
+        finally:
+            ariel_result_cache.release(key, searchId)
+        if cacheable:
+            ariel_result_cache.set(key, search_string, results)
+        return results
+
+    def __attachArielSearch(self, key, search_string):
+        """
+        Returns the running search recorded for key, or creates the search and records it
+        :return: search ID and its last known status
+        """
+        with ariel_result_cache.lock(key):
+            in_flight = ariel_result_cache.in_flight(key)
+            if in_flight:
+                try:
+                    res = self.__getUrl('ariel/searches/{}'.format(in_flight['search_id']))
+                except ConnectorError as err:
+                    self.log.debug('Search {0} can no longer be used: {1}'.format(in_flight['search_id'], err))
+                else:
+                    if res.get('status', '').lower() not in ['canceled', 'error']:
+                        self.log.debug('Re-attaching to running search {}'.format(in_flight['search_id']))
+                        return in_flight['search_id'], res
+            searchId, res = self.__createArielSearch(search_string)
+            ariel_result_cache.register(key, searchId)
+            return searchId, res
+
+    def arielSearchStream(self, search_string, page_size=None, max_rows=None, timeout=None, long_poll=None):
+        """
+        Runs an Ariel search and streams its records, so that the first pages can be consumed
+        before the remaining ones are retrieved
+        :return: generator of result records
+        """
+        searchId, res = self.__createArielSearch(search_string)
+        return self.iterArielResults(searchId, search_status=res, page_size=page_size, max_rows=max_rows,
+                                     timeout=timeout, long_poll=long_poll)
+
+    def __createArielSearch(self, search_string):
         endpoint = 'ariel/searches'
         self.log.debug('Running ariel search')
         search_string = self.__ensureStr(search_string)
@@ -179,30 +553,199 @@ class QradarConnection(object):
             'query_expression': search_string,
         }
         res = self.__postUrl(endpoint, params=params)
-        searchId = res.get('search_id')
-        return self.__getArielResults(searchId)
+        return res.get('search_id'), res
 
-    def getOffenses(self, filter_string, **kwargs):
+    def getOffenses(self, filter_string, fields=None, sort=None, paginate=False, page_size=None, max_results=None,
+                    **kwargs):
         # https://www.ibm.com/support/knowledgecenter/SS42VS_7.3.0/com.ibm.qradar.doc/c_rest_api_filtering.html
         # https://www.ibm.com/support/knowledgecenter/SS42VS_7.3.0/com.ibm.qradar.doc/8.0--siem-offenses-GET.html
+        if paginate:
+            return list(self.iterOffenses(filter_string, fields=fields, sort=sort, page_size=page_size,
+                                          max_results=max_results))
         endpoint = 'siem/offenses'
         self.log.debug('Getting offenses')
+        res = self.__getUrl(endpoint, params=self.__offenseParams(filter_string, fields, sort))
+        return res
+
+    def iterOffenses(self, filter_string, fields=None, sort=None, page_size=None, max_results=None):
+        """
+        Streams offenses page by page using Range headers
+        :param filter_string: offense filter, e.g. status="OPEN"
+        :param fields: comma separated fields to return, trims the payload
+        :param sort: sort expression, defaults to +id so that pages are stable
+        :param page_size: number of offenses requested per page
+        :param max_results: overall cap on the number of offenses returned
+        :return: generator of offenses
+        """
+        endpoint = 'siem/offenses'
+        self.log.debug('Getting offenses page by page')
+        params = self.__offenseParams(filter_string, fields, sort or '+id')
+        for offenses in self.__iterRange(endpoint, params=params, page_size=page_size, max_items=max_results):
+            for offense in offenses:
+                yield offense
+
+    def __offenseParams(self, filter_string, fields=None, sort=None):
         filter_string = self.__ensureStr(filter_string)
         self.log.debug('Filter String: {}'.format(filter_string))
         params = {
             'filter': filter_string
         }
+        if fields:
+            params['fields'] = self.__ensureStr(fields)
+        if sort:
+            params['sort'] = self.__ensureStr(sort)
+        return params
 
-        res = self.__getUrl(endpoint, params=params)
-        return res
+    def syncOffenses(self, filter_string=None, state_file=None, sync_name=None, start_time=None, fields=None,
+                     page_size=None, max_results=None, reset=False):
+        """
+        Returns the offenses updated since the previous call with the same state file.
+        Offenses are read in (last_updated_time, id) order, and the high-water mark is the
+        position of the last offense returned; it is only persisted once all pages were
+        fetched, so a run that fails part way is simply repeated by the next call.
+        :param filter_string: additional offense filter, e.g. status="OPEN"
+        :param state_file: path of the JSON state file, defaults to one per QRadar address, sync_name and filter
+        :param sync_name: distinguishes independent syncs that use the same filter
+        :param start_time: epoch milliseconds to start from when no state exists yet, defaults to now
+        :param fields: comma separated fields to return, id and last_updated_time are always added
+        :param page_size: number of offenses requested per page
+        :param max_results: cap on the offenses returned by one call, the rest follow on the next call
+        :param reset: discard the stored high-water mark and start again from start_time
+        :return: dict with the changed offenses and the high-water mark
+        """
+        filter_string = self.__ensureStr(filter_string or '').strip()
+        if not state_file:
+            # keyed by the QRadar address only, so that rotating the token or changing other settings keeps the mark
+            digest = hashlib.sha256(json.dumps([self.address.rstrip('/'), sync_name or '', filter_string])
+                                    .encode('utf-8'))
+            state_file = os.path.join(STATE_DIR, 'offense_sync_{}.json'.format(digest.hexdigest()[:32]))
+        page_size = int(page_size) if page_size else self.PAGE_SIZE
+        limit = int(max_results) if max_results else None
+        if fields:
+            wanted = [field.strip() for field in self.__ensureStr(fields).split(',') if field.strip()]
+            fields = ','.join(OrderedDict.fromkeys(['id', 'last_updated_time'] + wanted))
 
-    def getEventsRelatedToOffense(self, offense_id, start_time, end_time, result_limit=100, **kwargs):
+        with locked(state_file):
+            state = {} if reset else read_json(state_file, default={})
+            if 'last_updated_time' in state:
+                mark, last_id = int(state['last_updated_time']), int(state.get('last_id', -1))
+            else:
+                # A lost state file must not turn into a sync of every offense, so without a
+                # start time only the offenses updated from now on are returned
+                mark = int(start_time) if start_time is not None else int(time() * 1000)
+                last_id = -1
+                self.log.info('No offense sync state in {0}, starting from {1}'.format(state_file, mark))
+            offenses = OrderedDict()
+            while limit is None or len(offenses) < limit:
+                # Keyset paging: offenses sharing a last_updated_time are ordered by id, so a page
+                # boundary inside such a block neither skips nor repeats offenses
+                window = '(last_updated_time > {0} or (last_updated_time = {0} and id > {1}))'.format(mark, last_id)
+                if filter_string:
+                    window = '{0} and ({1})'.format(window, filter_string)
+                params = self.__offenseParams(window, fields, '+last_updated_time,+id')
+                page = self.__getUrl('siem/offenses', params=params,
+                                     headers={'Range': 'items=0-{}'.format(page_size - 1)})
+                if not page:
+                    break
+                for offense in page:
+                    position = (int(offense.get('last_updated_time') or 0), int(offense['id']))
+                    if position <= (mark, last_id):
+                        continue
+                    mark, last_id = position
+                    # an offense updated again while paging shows up twice, keep the latest copy
+                    offenses.pop(offense['id'], None)
+                    offenses[offense['id']] = offense
+                    if limit is not None and len(offenses) >= limit:
+                        break
+                if len(page) < page_size:
+                    break
+
+            state = {'last_updated_time': mark, 'last_id': last_id, 'filter': filter_string}
+            atomic_write_json(state_file, state)
+        self.log.debug('Offense sync returned {0} offenses, high-water mark {1}/{2}'.format(len(offenses), mark,
+                                                                                            last_id))
+        return {
+            'offenses': list(offenses.values()),
+            'count': len(offenses),
+            'last_updated_time': mark,
+            'last_id': last_id,
+            'state_file': state_file
+        }
+
+    def getEventsRelatedToOffense(self, offense_id, start_time, end_time, result_limit=100, timeout=None, long_poll=None,
+                                  use_cache=False, **kwargs):
         self.log.debug('Getting events related to offenseid {}'.format(offense_id))
         searchString = "select * from events where InOffense({}) limit {} start '{}' stop '{}'".format(offense_id,
                                                                                                        result_limit,
                                                                                                        start_time,
                                                                                                        end_time)
-        return self.arielSearch(searchString)
+        return self.arielSearch(searchString, timeout=timeout, long_poll=long_poll, use_cache=use_cache)
+
+    def getEventsRelatedToOffenses(self, offense_ids, start_time, end_time, result_limit=100, group_size=None,
+                                   timeout=None, long_poll=None, max_workers=None, use_cache=False):
+        """
+        Retrieves the events of many offenses with one Ariel search per group of offenses instead of
+        one search per offense. Each search selects a flag column per offense of its group, which is
+        used to hand every event back to the offenses it belongs to. When a group search hits its
+        limit, one busy offense may have crowded out the others, so the offenses of that group that
+        got fewer than result_limit events are searched again on their own.
+        :param offense_ids: list of offense IDs
+        :param result_limit: maximum number of events returned per offense
+        :param group_size: number of offenses covered by one search
+        :param max_workers: number of searches run at a time
+        :param use_cache: see arielSearch
+        :return: dict with the events, or the error, of every offense; truncated is set for the offenses
+                 that reached result_limit and may have more events
+        """
+        ids = list(OrderedDict.fromkeys(int(offense_id) for offense_id in offense_ids))
+        group_size = int(group_size) if group_size else self.OFFENSE_SEARCH_GROUP_SIZE
+        result_limit = int(result_limit) if result_limit else self.MAX_RESULTS
+        groups = [ids[start:start + group_size] for start in range(0, len(ids), group_size)]
+        self.log.debug('Getting events related to {0} offenses with {1} searches'.format(len(ids), len(groups)))
+
+        def search(group):
+            flags = ', '.join('CASE WHEN InOffense({0}) THEN 1 ELSE 0 END AS offense_{0}'.format(offense_id)
+                              for offense_id in group)
+            condition = ' OR '.join('InOffense({})'.format(offense_id) for offense_id in group)
+            # every offense of the group may use up its own limit
+            searchString = "select *, {0} from events where {1} limit {2} start '{3}' stop '{4}'".format(
+                flags, condition, result_limit * len(group), start_time, end_time)
+            return self.arielSearch(searchString, timeout=timeout, long_poll=long_poll, use_cache=use_cache)
+
+        offenses = OrderedDict((offense_id, {'offense_id': offense_id, 'events': [], 'error': None})
+                               for offense_id in ids)
+        starved = []
+        for group, res, error in self.__mapConcurrently(search, groups, max_workers):
+            if error:
+                for offense_id in group:
+                    offenses[offense_id]['error'] = error
+                continue
+            rows = (res or {}).get('events', [])
+            for event in rows:
+                members = [offense_id for offense_id in group
+                           if str(event.pop('offense_{}'.format(offense_id), 0)) in ('1', 'True', 'true')]
+                for offense_id in members:
+                    events = offenses[offense_id]['events']
+                    if len(events) < result_limit:
+                        events.append(dict(event) if len(members) > 1 else event)
+            if len(group) > 1 and len(rows) >= result_limit * len(group):
+                starved += [offense_id for offense_id in group if len(offenses[offense_id]['events']) < result_limit]
+
+        if starved:
+            self.log.debug('Searching events of {} offenses of truncated groups again'.format(len(starved)))
+
+            def search_alone(offense_id):
+                return self.getEventsRelatedToOffense(offense_id, start_time, end_time, result_limit, timeout=timeout,
+                                                      long_poll=long_poll, use_cache=use_cache)
+            for offense_id, res, error in self.__mapConcurrently(search_alone, starved, max_workers):
+                if error:
+                    offenses[offense_id]['error'] = error
+                else:
+                    offenses[offense_id]['events'] = (res or {}).get('events', [])[:result_limit]
+        for offense in offenses.values():
+            offense['count'] = len(offense['events'])
+            offense['truncated'] = offense['count'] >= result_limit
+        return {'offenses': list(offenses.values()), 'searches': len(groups) + len(starved)}
 
     def closeOffense(self, offense_id, offense_close_id, closure_note=None, **kwargs):
         if closure_note:
@@ -215,7 +758,7 @@ class QradarConnection(object):
         endpoint = 'siem/offenses/{}'.format(offense_id)
         self.log.debug('Getting offenses')
         params = {"closing_reason_id": offense_close_id, "status": "CLOSED"}
-        res = self.__postUrl(endpoint, params=params)
+        res = self.__postUrl(endpoint, params=params, idempotent=True)
         return res
 
     def addNote(self, offense_id, closure_note=None, **kwargs):
@@ -225,6 +768,55 @@ class QradarConnection(object):
         res = self.__postUrl(endpoint, params=params)
         return res
 
+    def bulkCloseOffenses(self, offenses, max_workers=None):
+        """
+        Closes many offenses concurrently, adding the closure note of each offense first
+        :param offenses: list of dicts with offense_id, offense_close_id and an optional closure_note
+        :param max_workers: number of offenses processed at a time
+        :return: summary with a per offense outcome
+        """
+        self.log.debug('Closing {} offenses'.format(len(offenses)))
+        progress = {}
+
+        def close(offense):
+            offense_id = offense['offense_id']
+            if offense.get('closure_note'):
+                self.addNote(offense_id, closure_note=offense['closure_note'])
+                progress[offense_id] = True
+            params = {"closing_reason_id": offense['offense_close_id'], "status": "CLOSED"}
+            return self.__postUrl('siem/offenses/{}'.format(offense_id), params=params, idempotent=True)
+
+        outcomes = self.__mapConcurrently(close, offenses, max_workers)
+        summary = {'requested': len(offenses), 'succeeded': 0, 'failed': 0, 'items': []}
+        for offense, res, error in outcomes:
+            summary['failed' if error else 'succeeded'] += 1
+            summary['items'].append({
+                'offense_id': offense['offense_id'],
+                'closing_reason_id': offense['offense_close_id'],
+                # a note can be added although closing the offense failed afterwards
+                'note_added': progress.get(offense['offense_id'], False),
+                'status': 'failed' if error else (res or {}).get('status', 'CLOSED'),
+                'error': error
+            })
+        return summary
+
+    def bulkAddNotes(self, notes, max_workers=None):
+        """
+        Adds notes to many offenses concurrently
+        :param notes: list of dicts with offense_id and closure_note
+        :param max_workers: number of notes sent at a time
+        :return: summary with a per offense outcome
+        """
+        self.log.debug('Adding notes to {} offenses'.format(len(notes)))
+        outcomes = self.__mapConcurrently(lambda note: self.addNote(note['offense_id'], note['closure_note']),
+                                          notes, max_workers)
+        summary = {'requested': len(notes), 'succeeded': 0, 'failed': 0, 'items': []}
+        for note, res, error in outcomes:
+            summary['failed' if error else 'succeeded'] += 1
+            summary['items'].append({'offense_id': note['offense_id'], 'note_id': (res or {}).get('id'),
+                                     'status': 'failed' if error else 'success', 'error': error})
+        return summary
+
     def getNote(self, offense_id, **kwargs):
         self.log.debug("Get notes of  {}".format(offense_id))
         endpoint = "siem/offenses/{}/notes".format(offense_id)
@@ -234,30 +826,43 @@ class QradarConnection(object):
     def get_closing_reasons(self):
         self.log.debug('Retrieving offense closing reason IDs')
         endpoint = 'siem/offense_closing_reasons'
-        res = self.__getUrl(endpoint)
+        res = self.__getCached(endpoint)
         return res
 
-    def get_address_details(self, endpoint, ips, params_fields):
+    def get_address_details(self, endpoint, ips, params_fields, max_workers=None):
         chunk = 100  # limit of send ips to GET request
+        ids = list(OrderedDict.fromkeys(str(ip).strip() for ip in ips))
+        if len(ids) < len(ips):
+            self.log.debug('Removed {} duplicate address IDs'.format(len(ips) - len(ids)))
+        chunks = [ids[start:start + chunk] for start in range(0, len(ids), chunk)]
+        max_workers = max_workers or self.max_workers
+        if len(chunks) <= 1 or max_workers <= 1:
+            pages = [self.__getAddressChunk(endpoint, ids_chunk, params_fields) for ids_chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                get_chunk = instrumentation.bind(lambda ids_chunk: self.__getAddressChunk(endpoint, ids_chunk,
+                                                                                          params_fields))
+                pages = list(executor.map(get_chunk, chunks))
         result = []
-        for i in range(0, len(ips), chunk):
-            start = i
-            filter_string = 'id in (' + ",".join(map(str, ips[start:start + chunk])) + ')'
-            self.log.info('Filter String: {}'.format(filter_string))
-            params = {
-                'filter': filter_string,
-                'fields': params_fields
-            }
-            res = self.__getUrl(endpoint, params=params)
+        for res in pages:
             result += res
         return result
 
+    def __getAddressChunk(self, endpoint, ids, params_fields):
+        filter_string = 'id in (' + ",".join(ids) + ')'
+        self.log.info('Filter String: {}'.format(filter_string))
+        params = {
+            'filter': filter_string,
+            'fields': params_fields
+        }
+        return self.__getUrl(endpoint, params=params)
+
     def getSourceIpAddresses(self, ips, **kwargs):
         endpoint = 'siem/source_addresses'
         self.log.debug('Getting ip details')
         # TODO: validate ids
         params_fields = 'id, source_ip, network, magnitude'
-        result = self.get_address_details(endpoint, ips, params_fields)
+        result = self.get_address_details(endpoint, ips, params_fields, max_workers=kwargs.get('max_workers'))
         return result
 
     def getDestinationIPAddresses(self, ips, **kwargs):
@@ -265,9 +870,200 @@ class QradarConnection(object):
         self.log.debug('Getting destination ip details')
         params_fields = 'id, local_destination_ip, network, magnitude'
         # TODO: validate ids
-        res = self.get_address_details(endpoint, ips, params_fields)
+        res = self.get_address_details(endpoint, ips, params_fields, max_workers=kwargs.get('max_workers'))
         return res
 
+    def __mapConcurrently(self, function, items, max_workers=None):
+        """
+        Calls function(item) for every item on a bounded thread pool
+        :return: list of (item, result, error) tuples in the order of items
+        """
+        def call(item):
+            try:
+                return item, function(item), None
+            except Exception as err:
+                self.log.warning('Concurrent call failed: {}'.format(err))
+                return item, None, str(err)
+
+        max_workers = max_workers or self.max_workers
+        if len(items) <= 1 or max_workers <= 1:
+            return [call(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            return list(executor.map(instrumentation.bind(call), items))
+
+    def bulkAddReferenceSetValues(self, name, values, batch_size=None, max_workers=None):
+        """
+        Adds values to a reference set through reference_data/sets/bulk_load, in concurrent batches
+        :param name: reference set name
+        :param values: list of values
+        :param batch_size: number of values sent per request
+        :return: summary with per batch and per value outcomes
+        """
+        endpoint = 'reference_data/sets/bulk_load/{}'.format(quote(str(name), safe=''))
+        batch_size = int(batch_size) if batch_size else self.BULK_BATCH_SIZE
+        batches = [values[start:start + batch_size] for start in range(0, len(values), batch_size)]
+        self.log.debug('Bulk loading {0} values into reference set {1} in {2} batches'.format(
+            len(values), name, len(batches)))
+        # Loading values into a set is idempotent, so failed batches may be retried
+        outcomes = self.__mapConcurrently(lambda batch: self.__postUrl(endpoint, json=batch, idempotent=True),
+                                          batches, max_workers)
+        summary = {'name': name, 'requested': len(values), 'succeeded': 0, 'failed': 0, 'batches': [], 'items': []}
+        for index, (batch, _, error) in enumerate(outcomes):
+            status = 'failed' if error else 'success'
+            summary['failed' if error else 'succeeded'] += len(batch)
+            summary['batches'].append({'batch': index, 'size': len(batch), 'status': status, 'error': error})
+            summary['items'].extend({'value': value, 'status': status, 'error': error} for value in batch)
+        if summary['succeeded']:
+            summary['number_of_elements'] = self.__referenceDataSize('sets', name)
+        return summary
+
+    def bulkDeleteReferenceSetValues(self, name, values, max_workers=None):
+        """
+        Deletes values from a reference set, one concurrent request per value
+        :param name: reference set name
+        :param values: list of values
+        :return: summary with per value outcomes
+        """
+        endpoint = 'reference_data/sets/{}/{{}}'.format(quote(str(name), safe=''))
+        self.log.debug('Deleting {0} values from reference set {1}'.format(len(values), name))
+        outcomes = self.__mapConcurrently(lambda value: self.__deleteUrl(endpoint.format(quote(str(value), safe=''))),
+                                          values, max_workers)
+        summary = {'name': name, 'requested': len(values), 'succeeded': 0, 'failed': 0, 'items': []}
+        for value, _, error in outcomes:
+            summary['failed' if error else 'succeeded'] += 1
+            summary['items'].append({'value': value, 'status': 'failed' if error else 'success', 'error': error})
+        if summary['succeeded']:
+            summary['number_of_elements'] = self.__referenceDataSize('sets', name)
+        return summary
+
+    def __referenceDataSize(self, kind, name):
+        # Bulk requests run concurrently, so the size reported by whichever answered last may be stale
+        res = self.__getUrl('reference_data/{0}/{1}'.format(kind, quote(str(name), safe='')),
+                            params={'fields': 'number_of_elements'})
+        return res.get('number_of_elements') if isinstance(res, dict) else None
+
+    def iterReferenceSetValues(self, name, page_size=None):
+        """
+        Streams the values of a reference set page by page
+        :param name: reference set name
+        :param page_size: number of elements requested per page
+        :return: generator of values
+        """
+        endpoint = 'reference_data/sets/{}'.format(quote(str(name), safe=''))
+        for elements in self.__iterRange(endpoint, page_size=page_size or self.REFERENCE_DATA_PAGE_SIZE,
+                                         extract=lambda res: res.get('data', []) if isinstance(res, dict) else []):
+            for element in elements:
+                yield element.get('value')
+
+    def syncReferenceSet(self, name, values, remove_missing=True, batch_size=None, page_size=None,
+                         allow_empty=False):
+        """
+        Makes a reference set contain exactly the given values, sending only the differences
+        :param name: reference set name
+        :param values: desired values
+        :param remove_missing: delete values of the set that are not in values
+        :param batch_size: number of values sent per bulk load request
+        :param page_size: number of elements requested per page when reading the set
+        :param allow_empty: accept an empty list of values, which empties the set when remove_missing is set
+        :return: summary of the values added, removed and failed
+        """
+        desired = list(OrderedDict.fromkeys(str(value) for value in values or []))
+        if not desired and not allow_empty:
+            raise ConnectorError('Values cannot be empty, an empty list would remove every value of the reference set; '
+                                 'allow empty sets explicitly to do so')
+        current = set(str(value) for value in self.iterReferenceSetValues(name, page_size=page_size))
+        desired_set = set(desired)
+        to_add = [value for value in desired if value not in current]
+        to_remove = [value for value in current if value not in desired_set] if remove_missing else []
+        self.log.debug('Syncing reference set {0}: {1} current, {2} desired, {3} to add, {4} to remove'.format(
+            name, len(current), len(desired), len(to_add), len(to_remove)))
+        summary = {'name': name, 'current': len(current), 'desired': len(desired), 'added': 0, 'removed': 0,
+                   'unchanged': len(desired) - len(to_add), 'failed': 0, 'failed_items': []}
+        for key, values_to_send, send in [
+                ('added', to_add, lambda: self.bulkAddReferenceSetValues(name, to_add, batch_size=batch_size)),
+                ('removed', sorted(to_remove), lambda: self.bulkDeleteReferenceSetValues(name, sorted(to_remove)))]:
+            if not values_to_send:
+                continue
+            result = send()
+            summary[key] = result['succeeded']
+            summary['failed'] += result['failed']
+            summary['failed_items'].extend(dict(item, action=key) for item in result['items']
+                                           if item['status'] == 'failed')
+            if 'number_of_elements' in result:
+                summary['number_of_elements'] = result['number_of_elements']
+        return summary
+
+    def iterTableElements(self, name, fields=None, namespace=None, page_size=None):
+        """
+        Streams the elements of a reference table page by page
+        :param name: reference table name
+        :param fields: fields projection, e.g. data(*(value))
+        :param namespace: reference table namespace
+        :param page_size: number of outer keys requested per page
+        :return: generator of (outer_key, inner_key, value) tuples
+        """
+        endpoint = 'reference_data/tables/{}'.format(quote(str(name), safe=''))
+        params = {}
+        if fields:
+            params['fields'] = self.__ensureStr(fields)
+        if namespace:
+            params['namespace'] = self.__ensureStr(namespace)
+        extract = lambda res: list(res.get('data', {}).items()) if isinstance(res, dict) else []
+        for outer_items in self.__iterRange(endpoint, params=params, extract=extract,
+                                            page_size=page_size or self.REFERENCE_DATA_PAGE_SIZE):
+            for outer_key, inner in outer_items:
+                for inner_key, element in inner.items():
+                    yield outer_key, inner_key, element.get('value') if isinstance(element, dict) else element
+
+    def __iterTableRows(self, elements):
+        # Accepts {outer_key: {inner_key: value}} or rows given as dicts or (outer_key, inner_key, value)
+        if isinstance(elements, dict):
+            for outer_key, inner in elements.items():
+                for inner_key, value in inner.items():
+                    yield outer_key, inner_key, value
+            return
+        for row in elements:
+            if isinstance(row, dict):
+                yield row['outer_key'], row['inner_key'], row['value']
+            else:
+                outer_key, inner_key, value = row
+                yield outer_key, inner_key, value
+
+    def bulkLoadReferenceTable(self, name, elements, batch_size=None, max_workers=None):
+        """
+        Loads elements into a reference table through reference_data/tables/bulk_load, in concurrent batches
+        :param name: reference table name
+        :param elements: {outer_key: {inner_key: value}} mapping or iterable of rows
+        :param batch_size: number of inner values sent per request
+        :return: summary with per batch outcomes
+        """
+        endpoint = 'reference_data/tables/bulk_load/{}'.format(quote(str(name), safe=''))
+        batch_size = int(batch_size) if batch_size else self.BULK_BATCH_SIZE
+        batches = []
+        batch, rows = {}, 0
+        for outer_key, inner_key, value in self.__iterTableRows(elements):
+            batch.setdefault(str(outer_key), {})[str(inner_key)] = value
+            rows += 1
+            if rows == batch_size:
+                batches.append((rows, batch))
+                batch, rows = {}, 0
+        if rows:
+            batches.append((rows, batch))
+        self.log.debug('Bulk loading {0} rows into reference table {1} in {2} batches'.format(
+            sum(size for size, batch in batches), name, len(batches)))
+        # bulk_load upserts, so failed batches may be retried
+        outcomes = self.__mapConcurrently(lambda item: self.__postUrl(endpoint, json=item[1], idempotent=True),
+                                          batches, max_workers)
+        summary = {'name': name, 'requested': 0, 'succeeded': 0, 'failed': 0, 'batches': []}
+        for index, ((size, batch), _, error) in enumerate(outcomes):
+            summary['requested'] += size
+            summary['failed' if error else 'succeeded'] += size
+            summary['batches'].append({'batch': index, 'size': size, 'outer_keys': len(batch),
+                                       'status': 'failed' if error else 'success', 'error': error})
+        if summary['succeeded']:
+            summary['number_of_elements'] = self.__referenceDataSize('tables', name)
+        return summary
+
     def invokeQRadarAPI(self, method, endpoint, params, headers, data={}):
         endpoint = endpoint.lstrip('/')
         if method.lower() == 'get':
@@ -285,7 +1081,7 @@ class QradarConnection(object):
     def get_offense_type(self):
         self.log.debug('Retrieving offense type IDs')
         endpoint = 'siem/offense_types'
-        res = self.__getUrl(endpoint)
+        res = self.__getCached(endpoint)
         return res
 
 #1.6.0
@@ -333,15 +1129,28 @@ class QradarConnection(object):
         logger.debug('Building endpoint: {}'.format(endpoint))
         return endpoint
 
-    def get_record(self, params):
+    def build_request(self, params):
+        """
+        Builds the endpoint, url_params, headers and payload of an endpoints operation
+        :param params: info.json Params
+        :return: endpoint, url_params, headers, data
+        """
+        endpoint = self.__build_endpoint(params)
+        url_params, headers, data = self.__args_parser(params)
+        return endpoint, url_params, headers, data
+
+    def get_record(self, params, use_cache=False):
         """
         Run GET operations
         :param params: info.json Params
+        :param use_cache: serve the response from the lookup cache, for near static endpoints
         :return: API call response content
         """
         endpoint = self.__build_endpoint(params)
         url_params, headers, data = self.__args_parser(params)
         self.log.debug('Getting Records. \nParams: {0}, \nHeaders: {1}'.format(url_params, headers))
+        if use_cache:
+            return self.__getCached(endpoint, params=url_params, headers=headers)
         return self.__getUrl(endpoint, params=url_params, headers=headers)
 
 
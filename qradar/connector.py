@@ -3,8 +3,10 @@
   All rights reserved.
   FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
   Copyright end """
+from time import perf_counter
 from connectors.core.connector import Connector
 from .funcs import operations, _check_health
+from .metrics import instrumentation
 from connectors.core.connector import get_logger, ConnectorError
 
 logger = get_logger('qradar')
@@ -13,12 +15,23 @@ logger = get_logger('qradar')
 class qradar(Connector):
     def execute(self, config, operation, params, **kwargs):
         logger.debug('execute(): Input is %s' % operations.get(operation))
+        operation_name = operation
         try:
             params.update({'operation':operation})
             operation = operations.get(operation)
         except Exception:
             return ['messagePROBLEM']
-        return operation(config, params, **kwargs)
+        instrumentation.start_operation(operation_name)
+        started = perf_counter()
+        status = 'error'
+        try:
+            result = operation(config, params, **kwargs)
+            status = 'success'
+            return result
+        finally:
+            instrumentation.emit('operation', operation=operation_name, status=status,
+                                 duration=perf_counter() - started)
+            instrumentation.end_operation()
 
     def check_health(self, config):
         logger.debug('starting health check')
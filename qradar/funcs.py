@@ -4,18 +4,55 @@
   FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
   Copyright end """
 import json
+from collections import OrderedDict
+from datetime import datetime, timezone
+from itertools import islice
 from .conn import QradarConnection
+from .async_conn import is_available as async_available, run_sync
+from .metrics import metrics_registry
 from connectors.core.connector import get_logger, ConnectorError
 
 logger = get_logger('qradar')
 
+ISO_DATE_FORMATS = ['%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']
+
 
 def get_offenses(config, params, *args, **kwargs):
     # address, token, verify_ssl=False, filter_string=None, *args, **kwargs
     logger.debug('getting offenses from qradar')
     filter_string = str(params.get('filter_string', ''))
+    page_size = params.get('page_size')
+    max_results = params.get('max_results')
+    q = QradarConnection(**config)
+    return q.getOffenses(filter_string, fields=params.get('fields'), sort=params.get('sort'),
+                         paginate=bool(page_size or max_results), page_size=page_size, max_results=max_results)
+
+
+def _to_epoch_millis(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    value = str(value).strip().replace('Z', '+00:00')
+    for date_format in ISO_DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        # dates without an offset are taken as UTC
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return int(parsed.timestamp() * 1000)
+    raise ConnectorError('Invalid start time {}, expected epoch milliseconds or an ISO 8601 date'.format(value))
+
+
+def sync_offenses(config, params, *args, **kwargs):
+    logger.debug('Syncing offenses updated since the last run')
     q = QradarConnection(**config)
-    return q.getOffenses(filter_string)
+    return q.syncOffenses(filter_string=params.get('filter_string'), state_file=params.get('state_file'),
+                          sync_name=params.get('sync_name'), start_time=_to_epoch_millis(params.get('start_time')),
+                          fields=params.get('fields'), page_size=params.get('page_size'),
+                          max_results=params.get('max_results'), reset=params.get('reset', False))
 
 
 def query_qradar(config, params, *args, **kwargs):
@@ -26,7 +63,32 @@ def query_qradar(config, params, *args, **kwargs):
         raise ConnectorError('Search String shorter than 3 characters in len')
     logger.debug('Search string: {}'.format(search_string))
     q = QradarConnection(**config)
-    return q.arielSearch(search_string)
+    return q.arielSearch(search_string, timeout=params.get('search_timeout'), long_poll=params.get('long_poll'),
+                         page_size=params.get('page_size'), max_rows=params.get('max_rows'),
+                         use_cache=params.get('use_cache', False))
+
+
+def submit_ariel_search(config, params, *args, **kwargs):
+    logger.debug('Submitting an Ariel search')
+    search_string = params.get('search_string', '')
+    if len(search_string) < 3:
+        raise ConnectorError('Search String shorter than 3 characters in len')
+    q = QradarConnection(**config)
+    return q.submitArielSearch(search_string, reuse_running=params.get('reuse_running', False))
+
+
+def get_ariel_search_status(config, params, *args, **kwargs):
+    logger.debug('Getting the status of Ariel search {}'.format(params['search_id']))
+    q = QradarConnection(**config)
+    return q.getArielSearchStatus(params['search_id'], wait=params.get('wait'))
+
+
+def get_ariel_search_results(config, params, *args, **kwargs):
+    logger.debug('Getting the results of Ariel search {}'.format(params['search_id']))
+    q = QradarConnection(**config)
+    return q.getArielSearchResults(params['search_id'], start=params.get('start'), page_size=params.get('page_size'),
+                                   max_rows=params.get('max_rows'), wait=params.get('wait_for_completion', False),
+                                   timeout=params.get('search_timeout'), long_poll=params.get('long_poll'))
 
 
 def get_events_related_to_offense(config, params, *args, **kwargs):
@@ -40,7 +102,31 @@ def get_events_related_to_offense(config, params, *args, **kwargs):
     return qradar_connection.getEventsRelatedToOffense(params['offense_id'],
                                                        start_time=params['start_time'][:-5].replace('T', ' '),
                                                        end_time=params['last_updated_time'][:-5].replace('T', ' '),
-                                                       result_limit=params['max_results'])
+                                                       result_limit=params['max_results'],
+                                                       timeout=params.get('search_timeout'),
+                                                       long_poll=params.get('long_poll'),
+                                                       use_cache=params.get('use_cache', False))
+
+
+def get_events_related_to_offenses(config, params, *args, **kwargs):
+    logger.debug('Looking for events related to multiple offenses')
+    offense_ids = _to_value_list(params.get('offense_ids') or [])
+    if not offense_ids:
+        raise ConnectorError('Specify the offense IDs to retrieve events for')
+    max_results = params.get('max_results')
+    if not isinstance(max_results, int):
+        logger.warning('Defaulting to 100 max results.')
+        max_results = 100
+    qradar_connection = QradarConnection(**config)
+    return qradar_connection.getEventsRelatedToOffenses(offense_ids,
+                                                        start_time=params['start_time'][:-5].replace('T', ' '),
+                                                        end_time=params['last_updated_time'][:-5].replace('T', ' '),
+                                                        result_limit=max_results,
+                                                        group_size=params.get('group_size'),
+                                                        timeout=params.get('search_timeout'),
+                                                        long_poll=params.get('long_poll'),
+                                                        max_workers=params.get('max_workers'),
+                                                        use_cache=params.get('use_cache', False))
 
 
 def _check_health(config):
@@ -58,6 +144,67 @@ def close_offense(config, params, *args, **kwargs):
     return qradar_connection.closeOffense(offense_id, offense_close_id, closure_note=closure_note)
 
 
+def _to_record_list(records, name):
+    if isinstance(records, str):
+        try:
+            records = json.loads(records)
+        except ValueError:
+            raise ConnectorError('{} must be a JSON list of objects'.format(name))
+    if isinstance(records, dict):
+        records = [records]
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise ConnectorError('{} must be a JSON list of objects'.format(name))
+    return records
+
+
+def _offense_batch(params, defaults, per_offense_param):
+    """
+    Builds the per offense records of a batch action, either from the per offense list or from
+    the offense IDs combined with the default values
+    """
+    if params.get(per_offense_param):
+        records = _to_record_list(params[per_offense_param], per_offense_param)
+    else:
+        records = [{'offense_id': offense_id} for offense_id in _to_value_list(params.get('offense_ids') or [])]
+    if not records:
+        raise ConnectorError('Specify the offense IDs to process')
+    batch = []
+    for record in records:
+        if record.get('offense_id') in (None, ''):
+            raise ConnectorError('Missing offense_id in {}'.format(record))
+        entry = dict(record)
+        for key, value in defaults.items():
+            if entry.get(key) in (None, ''):
+                entry[key] = value
+        batch.append(entry)
+    return batch
+
+
+def close_offenses(config, params, *args, **kwargs):
+    logger.debug('Attempting to close QRadar offenses in bulk')
+    offenses = _offense_batch(params, {'offense_close_id': params.get('offense_close_id'),
+                                       'closure_note': params.get('closure_note')}, 'offenses')
+    missing = [offense['offense_id'] for offense in offenses if offense.get('offense_close_id') in (None, '')]
+    if missing:
+        raise ConnectorError('Missing offense closing reason ID for offenses {}'.format(missing))
+    qradar_connection = QradarConnection(**config)
+    response = qradar_connection.bulkCloseOffenses(offenses, max_workers=params.get('max_workers'))
+    response['message'] = 'Closed {0} offenses, {1} failed'.format(response['succeeded'], response['failed'])
+    return response
+
+
+def add_notes_bulk(config, params, *args, **kwargs):
+    logger.debug('Create notes on offenses in bulk.')
+    notes = _offense_batch(params, {'closure_note': params.get('closure_note')}, 'notes')
+    missing = [note['offense_id'] for note in notes if not note.get('closure_note')]
+    if missing:
+        raise ConnectorError('Missing note text for offenses {}'.format(missing))
+    qradar_connection = QradarConnection(**config)
+    response = qradar_connection.bulkAddNotes(notes, max_workers=params.get('max_workers'))
+    response['message'] = 'Added notes to {0} offenses, {1} failed'.format(response['succeeded'], response['failed'])
+    return response
+
+
 def get_closing_reasons(config, params, *args, **kwargs):
     logger.debug('Attempting to retrieve offense close reasons IDs')
     qradar_connection = QradarConnection(**config)
@@ -70,14 +217,40 @@ def get_offense_type(config, params, *args, **kwargs):
     return qradar_connection.get_offense_type()
 
 
+LOOKUP_ENDPOINTS = {
+    'Offense Closing Reasons': 'siem/offense_closing_reasons',
+    'Offense Types': 'siem/offense_types',
+    'Asset Properties': 'asset_model/properties'
+}
+
+
+def invalidate_lookup_cache(config, params, *args, **kwargs):
+    lookup = params.get('lookup') or 'All'
+    if lookup != 'All' and lookup not in LOOKUP_ENDPOINTS:
+        raise ConnectorError('Unsupported lookup {}'.format(lookup))
+    qradar_connection = QradarConnection(**config)
+    removed = qradar_connection.invalidateLookupCache(LOOKUP_ENDPOINTS.get(lookup))
+    return {'lookup': lookup, 'invalidated': removed}
+
+
+def get_metrics(config, params, *args, **kwargs):
+    if params.get('format') == 'Prometheus':
+        return {'metrics': metrics_registry.render_prometheus()}
+    return metrics_registry.snapshot()
+
+
 def get_source_ip(config, params, *args, **kwargs):
     ips = params['source_address_ids']
+    if async_available():
+        return run_sync(config, lambda connection: connection.getSourceIpAddresses(ips))
     qradar_connection = QradarConnection(**config)
     return qradar_connection.getSourceIpAddresses(ips)
 
 
 def get_destination_ip(config, params, *args, **kwargs):
     ips = params['destination_address_ids']
+    if async_available():
+        return run_sync(config, lambda connection: connection.getDestinationIPAddresses(ips))
     qradar_connection = QradarConnection(**config)
     return qradar_connection.getDestinationIPAddresses(ips)
 
@@ -92,21 +265,59 @@ def invoke_qradar_api(config, params, *args, **kwargs):
     return qradar_connection.invokeQRadarAPI(method, endpoint, request_parameters, headers, json.dumps(request_payload))
 
 
+def _to_value_list(values):
+    if values is None:
+        return []
+    if isinstance(values, str):
+        values = values.replace('\n', ',').split(',')
+    elif not isinstance(values, (list, tuple, set)):
+        values = [values]
+    return list(OrderedDict.fromkeys(str(value).strip() for value in values if str(value).strip()))
+
+
 def handle_reference_set_value(config, params, *args, **kwargs):
     qradar_connection = QradarConnection(**config)
     method_name = params['method']
     params_value = params.get('value', '')
 
-    reference_set_map = {
-        'Retrieves Value': ['get', 'reference_data/sets/{name}'.format(name=params['name'])],
-        'Add Value': ['post', 'reference_data/sets/{name}'.format(name=params['name'])],
-        'Delete Value': ['delete', 'reference_data/sets/{name}/{value}'.format(name=params['name'], value=params_value)]
-    }
-    method = reference_set_map[method_name][0]
-    endpoint = reference_set_map[method_name][1]
-    del params['method']
-    response = qradar_connection.invokeQRadarAPI(method, endpoint, params, {})
-    response['message'] = 'Successfully perform {0} method on reference set {1}'.format(method_name, params['name'])
+    if method_name in ['Bulk Add Values', 'Bulk Delete Values']:
+        values = _to_value_list(params.get('values'))
+        if not values:
+            raise ConnectorError('Values cannot be empty for {}'.format(method_name))
+        if method_name == 'Bulk Add Values':
+            response = qradar_connection.bulkAddReferenceSetValues(params['name'], values,
+                                                                   batch_size=params.get('batch_size'))
+        else:
+            response = qradar_connection.bulkDeleteReferenceSetValues(params['name'], values)
+    else:
+        reference_set_map = {
+            'Retrieves Value': ['get', 'reference_data/sets/{name}'.format(name=params['name'])],
+            'Add Value': ['post', 'reference_data/sets/{name}'.format(name=params['name'])],
+            'Delete Value': ['delete', 'reference_data/sets/{name}/{value}'.format(name=params['name'],
+                                                                                   value=params_value)]
+        }
+        method = reference_set_map[method_name][0]
+        endpoint = reference_set_map[method_name][1]
+        del params['method']
+        response = qradar_connection.invokeQRadarAPI(method, endpoint, params, {})
+        response['message'] = 'Successfully perform {0} method on reference set {1}'.format(method_name,
+                                                                                              params['name'])
+        return response
+    response['message'] = 'Performed {0} method on reference set {1}: {2} values succeeded, {3} failed'.format(
+        method_name, params['name'], response['succeeded'], response['failed'])
+    return response
+
+
+def sync_reference_set(config, params, *args, **kwargs):
+    logger.debug('Syncing reference set {}'.format(params['name']))
+    qradar_connection = QradarConnection(**config)
+    response = qradar_connection.syncReferenceSet(params['name'], _to_value_list(params.get('values')),
+                                                  remove_missing=params.get('remove_missing', True),
+                                                  allow_empty=params.get('allow_empty', False),
+                                                  batch_size=params.get('batch_size'),
+                                                  page_size=params.get('page_size'))
+    response['message'] = 'Synced reference set {0}: {1} values added, {2} removed, {3} failed'.format(
+        params['name'], response['added'], response['removed'], response['failed'])
     return response
 
 
@@ -131,6 +342,11 @@ def get_record(config, params, *args, **kwargs):
     return qradar_connection.get_record(params)
 
 
+def get_assets_properties(config, params, *args, **kwargs):
+    qradar_connection = QradarConnection(**config)
+    return qradar_connection.get_record(params, use_cache=True)
+
+
 def update_record(config, params, *args, **kwargs):
     qradar_connection = QradarConnection(**config)
     return qradar_connection.update_record(params)
@@ -141,27 +357,71 @@ def delete_record(config, params, *args, **kwargs):
     return qradar_connection.delete_record(params)
 
 
+def get_table_elements(config, params, *args, **kwargs):
+    qradar_connection = QradarConnection(**config)
+    if not params.get('page_size'):
+        return qradar_connection.get_record(params)
+    rows = qradar_connection.iterTableElements(params['path.name'], fields=params.get('query.fields'),
+                                               namespace=params.get('query.namespace'),
+                                               page_size=params['page_size'])
+    if params.get('max_results'):
+        rows = islice(rows, int(params['max_results']))
+    return {
+        'name': params['path.name'],
+        'rows': [{'outer_key': outer_key, 'inner_key': inner_key, 'value': value}
+                 for outer_key, inner_key, value in rows]
+    }
+
+
+def bulk_load_table_elements(config, params, *args, **kwargs):
+    logger.debug('Bulk loading reference table {}'.format(params['name']))
+    elements = params.get('elements')
+    if isinstance(elements, str):
+        try:
+            elements = json.loads(elements)
+        except ValueError:
+            raise ConnectorError('Elements must be a JSON object or a list of rows')
+    if not elements:
+        raise ConnectorError('Elements cannot be empty')
+    qradar_connection = QradarConnection(**config)
+    response = qradar_connection.bulkLoadReferenceTable(params['name'], elements, batch_size=params.get('batch_size'))
+    response['message'] = 'Loaded reference table {0}: {1} rows succeeded, {2} failed'.format(
+        params['name'], response['succeeded'], response['failed'])
+    return response
+
+
 operations = {
     'get_offenses': get_offenses,
+    'sync_offenses': sync_offenses,
     'query_qradar': query_qradar,
+    'submit_ariel_search': submit_ariel_search,
+    'get_ariel_search_status': get_ariel_search_status,
+    'get_ariel_search_results': get_ariel_search_results,
     'get_events_related_to_offense': get_events_related_to_offense,
+    'get_events_related_to_offenses': get_events_related_to_offenses,
     'get_closing_reasons': get_closing_reasons,
     'close_offense': close_offense,
+    'close_offenses': close_offenses,
     'get_source_ip': get_source_ip,
     'get_destination_ip': get_destination_ip,
     'invoke_api': invoke_qradar_api,
     'get_offense_type': get_offense_type,
+    'get_metrics': get_metrics,
+    'invalidate_lookup_cache': invalidate_lookup_cache,
     'handle_reference_set_value': handle_reference_set_value,
+    'sync_reference_set': sync_reference_set,
     'add_notes': add_notes,
+    'add_notes_bulk': add_notes_bulk,
     'get_notes': get_notes,
-    'get_assets_properties':get_record,
+    'get_assets_properties': get_assets_properties,
     'get_assets': get_record,
     'update_asset': update_record,
     'get_cases': get_record,
     'create_case': update_record,
     'get_reference_tables': get_record,
     'delete_reference_table': delete_record,
-    'get_table_elements': get_record,
+    'get_table_elements': get_table_elements,
     'add_table_element': update_record,
+    'bulk_load_table_elements': bulk_load_table_elements,
     'delete_table_element': delete_record
 }
\ No newline at end of file
@@ -0,0 +1,227 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import json
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from connectors.core.connector import get_logger
+
+logger = get_logger("qradar")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max, 'buckets': buckets}
+
+
+class MetricsRegistry(object):
+    """
+    In-process counters and histograms, identified by a metric name and a set of labels
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def register_collector(self, name, collect):
+        """
+        Adds a callable returning a dict of gauges, e.g. session_registry.stats, reported under name
+        """
+        with self._lock:
+            self._collectors[name] = collect
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+        :return: dict of counters, histograms and collector gauges, suitable for json.dumps
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [dict(histogram.to_dict(), name=name, labels=dict(labels))
+                          for (name, labels), histogram in sorted(self._histograms.items())]
+            collectors = dict(self._collectors)
+        gauges = {}
+        for name, collect in collectors.items():
+            try:
+                gauges[name] = collect()
+            except Exception as err:
+                logger.warning('Metrics collector {0} failed: {1}'.format(name, err))
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    def render_prometheus(self):
+        """
+        :return: snapshot in the Prometheus text exposition format
+        """
+        def labels_text(labels, **extra):
+            labels = dict(labels, **extra)
+            if not labels:
+                return ''
+            return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('"', '\\"'))
+                                  for k, v in sorted(labels.items())) + '}'
+
+        snapshot = self.snapshot()
+        lines = []
+        for counter in snapshot['counters']:
+            lines.append('{0}{1} {2}'.format(counter['name'], labels_text(counter['labels']), counter['value']))
+        for histogram in snapshot['histograms']:
+            for bound, count in histogram['buckets'].items():
+                lines.append('{0}_bucket{1} {2}'.format(histogram['name'], labels_text(histogram['labels'], le=bound),
+                                                        count))
+            lines.append('{0}_count{1} {2}'.format(histogram['name'], labels_text(histogram['labels']),
+                                                   histogram['count']))
+            lines.append('{0}_sum{1} {2}'.format(histogram['name'], labels_text(histogram['labels']),
+                                                 histogram['sum']))
+        for collector, gauges in snapshot['gauges'].items():
+            for name, value in sorted(gauges.items()):
+                if isinstance(value, (int, float)):
+                    lines.append('qradar_{0}_{1} {2}'.format(collector, name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class Instrumentation(object):
+    """
+    Fans out timing records (operations, HTTP requests, decoding, Ariel searches) to
+    pluggable sinks. A sink is any callable taking the record dict; by default records
+    update the metrics registry and are written to the debug log as JSON.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._sinks = []
+        self._local = threading.local()
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self._sinks:
+            self._sinks.remove(sink)
+
+    @property
+    def current_operation(self):
+        return getattr(self._local, 'operation', None)
+
+    def start_operation(self, operation):
+        self._local.operation = operation
+
+    def end_operation(self):
+        self._local.operation = None
+
+    def bind(self, function):
+        """
+        Wraps function so that it runs under the operation of the calling thread, for work handed to a thread pool
+        """
+        operation = self.current_operation
+
+        def bound(*args, **kwargs):
+            previous = self.current_operation
+            self._local.operation = operation
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.operation = previous
+        return bound
+
+    def emit(self, kind, **fields):
+        record = dict(fields, kind=kind, timestamp=time.time())
+        if 'operation' not in record and self.current_operation:
+            record['operation'] = self.current_operation
+        for sink in list(self._sinks):
+            try:
+                sink(record)
+            except Exception as err:
+                logger.warning('Instrumentation sink failed: {}'.format(err))
+
+
+def normalize_endpoint(endpoint):
+    """
+    Replaces IDs in an endpoint path so that metrics labels stay bounded,
+    e.g. siem/offenses/42/notes -> siem/offenses/{id}/notes
+    """
+    endpoint = re.sub(r'^(ariel/searches)/[^/]+', r'\1/{id}', endpoint)
+    return re.sub(r'/\d+(?=/|$)', '/{id}', endpoint)
+
+
+def registry_sink(record):
+    kind = record['kind']
+    if kind == 'operation':
+        metrics_registry.inc('qradar_operations_total', operation=record['operation'], status=record['status'])
+        metrics_registry.observe('qradar_operation_seconds', record['duration'], operation=record['operation'])
+    elif kind == 'request':
+        labels = {'method': record['method'], 'endpoint': record['endpoint']}
+        metrics_registry.inc('qradar_requests_total', status=record['status'], **labels)
+        metrics_registry.observe('qradar_request_seconds', record['duration'], **labels)
+        metrics_registry.inc('qradar_request_bytes_sent_total', record['bytes_sent'], **labels)
+        metrics_registry.inc('qradar_request_bytes_received_total', record['bytes_received'], **labels)
+        if record['retries']:
+            metrics_registry.inc('qradar_request_retries_total', record['retries'], **labels)
+    elif kind == 'decode':
+        metrics_registry.observe('qradar_decode_seconds', record['duration'])
+        metrics_registry.inc('qradar_decoded_bytes_total', record['bytes'])
+    elif kind == 'ariel_search':
+        metrics_registry.observe('qradar_ariel_wait_seconds', record['wait'])
+        metrics_registry.observe('qradar_ariel_execution_seconds', record['execution'])
+        metrics_registry.observe('qradar_ariel_queue_seconds', record['queue'])
+
+
+def log_sink(record):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('metrics {}'.format(json.dumps(record, sort_keys=True, default=str)))
+
+
+metrics_registry = MetricsRegistry()
+instrumentation = Instrumentation(metrics_registry)
+instrumentation.add_sink(registry_sink)
+instrumentation.add_sink(log_sink)
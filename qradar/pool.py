@@ -0,0 +1,122 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import hashlib
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from connectors.core.connector import get_logger
+
+logger = get_logger("qradar")
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_MAX_AGE = 3600
+
+
+class _PooledSession(object):
+    def __init__(self, session, idle_timeout, max_age):
+        self.session = session
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    def is_stale(self, now):
+        return (now - self.last_used) > self.idle_timeout or (now - self.created) > self.max_age
+
+
+class SessionRegistry(object):
+    """
+    Process wide registry of pooled requests sessions, keyed by QRadar instance
+    (address, token, verify_ssl, api_version). Sessions are shared across
+    QradarConnection objects so that repeated actions reuse open TCP/TLS
+    connections instead of handshaking on every call.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_age=DEFAULT_MAX_AGE):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(address, token, verify_ssl, api_version):
+        token_digest = hashlib.sha256(str(token).encode('utf-8')).hexdigest()
+        return address, token_digest, verify_ssl, str(api_version)
+
+    def get_session(self, address, token, verify_ssl=True, api_version='6.0', pool_size=None, idle_timeout=None,
+                    max_age=None):
+        """
+        Returns the shared session for a QRadar instance, creating it on first use
+        :param pool_size: maximum number of connections kept open to the instance
+        :param idle_timeout: seconds after which an unused session is closed
+        :param max_age: seconds after which a session is recycled regardless of use
+        :return: requests.Session
+        """
+        key = self.make_key(address, token, verify_ssl, api_version)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_stale(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry.last_used = now
+                return entry.session
+            self.misses += 1
+            session = self._create_session(token, verify_ssl, api_version, pool_size or self.pool_size)
+            self._entries[key] = _PooledSession(session,
+                                                idle_timeout if idle_timeout is not None else self.idle_timeout,
+                                                max_age if max_age is not None else self.max_age)
+            logger.debug('Created pooled session for {0}, registry size {1}'.format(address, len(self._entries)))
+            return session
+
+    def _create_session(self, token, verify_ssl, api_version, pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'SEC': token,
+            'Version': str(api_version),
+        })
+        session.verify = verify_ssl
+        return session
+
+    def _evict_stale(self, now):
+        # Closing a session only drops its idle connections; a request still in
+        # flight on another thread completes normally and its connection is discarded.
+        for key in [k for k, entry in self._entries.items() if entry.is_stale(now)]:
+            entry = self._entries.pop(key)
+            entry.session.close()
+            self.evictions += 1
+
+    def evict(self, address=None):
+        """
+        Closes and removes pooled sessions, all of them or only those for one address
+        """
+        with self._lock:
+            for key in [k for k in self._entries if address is None or k[0] == address]:
+                self._entries.pop(key).session.close()
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+session_registry = SessionRegistry()
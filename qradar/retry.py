@@ -0,0 +1,170 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.exceptions import SSLError, ReadTimeout
+
+RETRY_STATUSES = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# A certificate problem does not go away on retry, and a read timeout already waited the full
+# request timeout; only connection failures and connect timeouts are retried
+NON_RETRYABLE_ERRORS = (SSLError, ReadTimeout)
+# Requests per second sent to one QRadar instance, 0 disables the client side rate limit
+DEFAULT_RATE_LIMIT = 0
+DEFAULT_RATE_LIMIT_BURST = 50
+
+
+class RetryBudget(object):
+    """
+    Process wide cap on retries: every request deposits `ratio` tokens and every retry
+    spends one, so retries can never exceed roughly `ratio` of the traffic once the
+    initial reserve of `min_retries` is used up. Keeps a struggling QRadar from being
+    hit by a retry storm when many playbooks fail at the same time.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10, max_balance=100):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self._balance = float(min_retries)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._balance + self.ratio, self.max_balance)
+
+    def withdraw(self):
+        with self._lock:
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+
+class TokenBucket(object):
+    """
+    Client side rate limiter allowing `rate` requests per second with bursts of up to `capacity`
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, capacity=DEFAULT_RATE_LIMIT_BURST):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, rate, capacity):
+        with self._lock:
+            self.rate = float(rate)
+            self.capacity = float(capacity)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def reserve(self):
+        """
+        Takes a token without waiting for it
+        :return: seconds the caller must wait before sending its request
+        """
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token right away, a negative balance queues callers behind each other
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent
+        :return: seconds spent waiting
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed request is retried and how long to wait before doing so.
+    Idempotent methods are retried on connection errors and on RETRY_STATUSES; other
+    methods (POST, PATCH) only when the caller opts in, except for 429 responses
+    which QRadar rejects before processing them. NON_RETRYABLE_ERRORS are never retried.
+    """
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=30, retry_statuses=RETRY_STATUSES,
+                 budget=None, non_retryable_errors=NON_RETRYABLE_ERRORS):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.budget = budget
+        self.non_retryable_errors = non_retryable_errors
+
+    def is_retryable(self, method, attempt, status_code=None, idempotent=None, error=None):
+        """
+        :param status_code: status code of the response, None when the request raised error
+        :param error: exception raised by the request
+        """
+        if attempt >= self.max_retries:
+            return False
+        if error is not None and isinstance(error, self.non_retryable_errors):
+            return False
+        if status_code is not None and status_code not in self.retry_statuses:
+            return False
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if not idempotent and status_code != 429:
+            return False
+        return self.budget is None or self.budget.withdraw()
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Exponential backoff with full jitter, never shorter than a Retry-After header
+        :param attempt: number of retries already made
+        :param retry_after: Retry-After header value, seconds or an HTTP date
+        :return: seconds to wait
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+        retry_after = parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+retry_budget = RetryBudget()
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(key, rate=DEFAULT_RATE_LIMIT, capacity=DEFAULT_RATE_LIMIT_BURST):
+    """
+    Returns the token bucket shared by every connection to the QRadar instance identified by key,
+    updated to the given rate and capacity when the configuration changed since it was created
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = _rate_limiters[key] = TokenBucket(rate, capacity)
+        else:
+            limiter.configure(rate, capacity)
+        return limiter
@@ -0,0 +1,98 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from connectors.core.connector import get_logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = get_logger("qradar")
+
+# State that must survive reboots and temp directory cleanup, such as offense sync high-water marks,
+# lives in the home directory of the connector user unless QRADAR_CONNECTOR_STATE_DIR points elsewhere;
+# caches that can be rebuilt stay in the temp directory
+STATE_DIR = os.environ.get('QRADAR_CONNECTOR_STATE_DIR') or os.path.join(os.path.expanduser('~'), '.qradar_connector')
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'qradar_connector')
+
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+def atomic_write_json(path, data):
+    """
+    Writes data as JSON to a temporary file next to path and renames it over path,
+    so that readers never see a partially written file
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(data, tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_json(path, default=None):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (IOError, OSError, ValueError) as err:
+        if os.path.exists(path):
+            logger.warning('Ignoring unreadable state file {0}: {1}'.format(path, err))
+        return default
+
+
+@contextmanager
+def locked(path, remove=False):
+    """
+    Serialises access to path between threads and, where fcntl is available, between processes
+    :param remove: delete the lock file on release, for locks that are not needed again
+    """
+    with _path_locks_lock:
+        thread_lock = _path_locks.setdefault(path, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        lock_path = path + '.lock'
+        lock_file = _acquire(lock_path)
+        try:
+            yield
+        finally:
+            if remove:
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+
+def _acquire(lock_path):
+    while True:
+        lock_file = open(lock_path, 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # A holder that removed the lock file leaves its waiters locking a file no one else
+        # will open again, so the lock only counts if the file is still the one at lock_path
+        try:
+            if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                return lock_file
+        except OSError:
+            pass
+        lock_file.close()
@@ -0,0 +1,40 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import json
+
+LOG_BODY_LIMIT = 4096
+
+
+def decode_response(response):
+    """
+    Decodes a response body in a single pass
+    :param response: requests.Response
+    :return: parsed JSON, the raw content if it is not JSON, or None for an empty body
+    """
+    content = response.content
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content
+
+
+def truncate_body(body, limit=LOG_BODY_LIMIT):
+    """
+    Shortens a body for logging
+    :param body: str or bytes
+    :param limit: maximum number of characters kept, 0 keeps everything
+    :return: str
+    """
+    remaining = len(body) - limit if limit else 0
+    if remaining > 0:
+        body = body[:limit]
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    if remaining > 0:
+        return '{0}... [{1} more characters]'.format(body, remaining)
+    return body
@@ -0,0 +1,30 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+# Connector tests run against the local fake QRadar server of the benchmark suite.
+# Modules importing the connector skip themselves when the FortiSOAR connector
+# runtime (connectors.core) is not on the python path, and the app tests when the
+# QRadar app (Python 2) cannot be imported.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture
+def fake_qradar():
+    from benchmarks.fake_qradar import FakeQRadar
+    fake = FakeQRadar(search_duration=0)
+    fake.url = fake.start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def config(fake_qradar):
+    return {'address': fake_qradar.url, 'token': 'test-token', 'verify_ssl': False, 'api_version': '15.0'}
+
@@ -0,0 +1,72 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('connectors.core.connector')
+
+from qradar import cache  # noqa: E402
+from qradar.cache import ariel_result_cache  # noqa: E402
+from qradar.conn import QradarConnection  # noqa: E402
+
+PAST = "select * from events start '2020-09-13 12:00:00' stop '2020-09-13 13:00:00'"
+RECENT = "select * from events start '{0}' stop '{1}'".format(
+    time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - 3600)),
+    time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ariel_result_cache, 'directory', str(tmp_path))
+    return tmp_path
+
+
+def run_together(config, search_string, count=4):
+    with ThreadPoolExecutor(count) as executor:
+        return list(executor.map(lambda _: QradarConnection(**config).arielSearch(search_string, use_cache=True),
+                                 range(count)))
+
+
+def test_recent_window_reattaches_without_caching(fake_qradar, config, cache_dir):
+    fake_qradar.search_duration = 0.5
+    assert not ariel_result_cache.cacheable(RECENT)
+    results = run_together(config, RECENT)
+    assert len(fake_qradar.searches) == 1
+    assert all(result == results[0] for result in results)
+    assert os.listdir(str(cache_dir)) == []
+    QradarConnection(**config).arielSearch(RECENT, use_cache=True)
+    assert len(fake_qradar.searches) == 2
+
+
+def test_past_window_is_cached(fake_qradar, config, cache_dir):
+    assert ariel_result_cache.cacheable(PAST)
+    first = QradarConnection(**config).arielSearch(PAST, use_cache=True)
+    assert QradarConnection(**config).arielSearch(PAST, use_cache=True) == first
+    assert len(fake_qradar.searches) == 1
+    assert [name for name in os.listdir(str(cache_dir)) if not name.endswith('.json')] == []
+
+
+def test_prune_removes_abandoned_searches(cache_dir, monkeypatch):
+    key = ariel_result_cache.key(('instance',), RECENT)
+    with ariel_result_cache.lock(key):
+        ariel_result_cache.register(key, 'abandoned')
+    ariel_result_cache.evict()
+    assert ariel_result_cache.in_flight(key)['search_id'] == 'abandoned'
+    # a search older than this is no longer running
+    monkeypatch.setattr(cache, 'ARIEL_IN_FLIGHT_MAX_AGE', -1)
+    ariel_result_cache.evict()
+    assert os.listdir(str(cache_dir)) == []
+
+
+def test_submit_reuses_a_running_recent_search(fake_qradar, config):
+    fake_qradar.search_duration = 5
+    first = QradarConnection(**config).submitArielSearch(RECENT, reuse_running=True)
+    second = QradarConnection(**config).submitArielSearch(RECENT, reuse_running=True)
+    assert first['search_id'] == second['search_id']
+    assert len(fake_qradar.searches) == 1
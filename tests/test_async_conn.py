@@ -0,0 +1,21 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import pytest
+
+pytest.importorskip('connectors.core.connector')
+pytest.importorskip('aiohttp')
+
+from qradar.funcs import get_source_ip  # noqa: E402
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_address_lookups_honour_max_workers(fake_qradar, config, max_workers):
+    fake_qradar.latency = 0.05
+    config['max_workers'] = max_workers
+    # 1000 ids are looked up in 10 pages of 100
+    get_source_ip(config, {'source_address_ids': list(range(1, 1001))})
+    assert fake_qradar.requests == 10
+    assert fake_qradar.max_in_flight == max_workers
@@ -0,0 +1,79 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+# The QRadar app runs on Python 2; under Python 3 these tests are skipped.
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'app'))
+# qpylib runs outside a QRadar console in SDK mode, logging into a throwaway workspace
+os.environ.setdefault('QRADAR_APPFW_SDK', 'true')
+os.environ.setdefault('QRADAR_APPFW_WORKSPACE', tempfile.mkdtemp())
+pytest.importorskip('qpylib')
+
+import forward_queue  # noqa: E402
+from cyops import PartialDelivery  # noqa: E402
+from qpylib import qpylib  # noqa: E402
+
+qpylib.create_log()
+
+
+class Recorder(object):
+    def __init__(self, failures=()):
+        self.calls = []
+        self.failures = list(failures)
+
+    def __call__(self, offense_ids):
+        self.calls.append(list(offense_ids))
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure is not None:
+                raise failure
+
+
+@pytest.fixture
+def make_queue(tmpdir, monkeypatch):
+    monkeypatch.setattr(forward_queue, 'COALESCE_WINDOW', 0)
+
+    def make(send_many=None):
+        queue = forward_queue.ForwardQueue(str(tmpdir), lambda offense_id: None, send_many=send_many)
+        # jobs are processed by the test rather than by the background worker
+        queue.start = lambda: None
+        return queue
+    return make
+
+
+def test_recover_stale_requeues_only_old_claims(make_queue):
+    queue = make_queue()
+    queue.enqueue_many(['1', '2'], bulk=False)
+    stale, fresh = [queue.claim(path) for path in queue.pending_jobs()]
+    old = time.time() - forward_queue.INFLIGHT_TIMEOUT - 1
+    os.utime(stale, (old, old))
+    queue.recover_stale()
+    assert [os.path.basename(path) for path in queue.pending_jobs()] == [os.path.basename(stale)]
+    assert queue.list_jobs(queue.inflight_dir) == [fresh]
+
+
+def test_partial_bulk_failure_retries_the_rest_together(make_queue):
+    send_many = Recorder([PartialDelivery('chunk failed', ['1', '2']), None])
+    queue = make_queue(send_many)
+    queue.enqueue_many(['1', '2', '3', '4'])
+    queue.process_due()
+    pending = [queue.read_job(path) for path in queue.pending_jobs()]
+    assert [job['offense_id'] for job in pending] == ['3', '4']
+    assert [job['attempts'] for job in pending] == [1, 1]
+    # both are due at the same time, so they are sent again as one request
+    assert pending[0]['next_attempt'] == pending[1]['next_attempt'] > time.time()
+    for path, job in zip(queue.pending_jobs(), pending):
+        job['next_attempt'] = time.time()
+        queue.write_job(path, job)
+    queue.process_due()
+    assert send_many.calls == [['1', '2', '3', '4'], ['3', '4']]
+    assert queue.status()['depth'] == 0
+    assert queue.stats['delivered'] == 4
@@ -0,0 +1,43 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import pytest
+
+connector = pytest.importorskip('connectors.core.connector')
+
+from qradar.funcs import _to_value_list, handle_reference_set_value, sync_reference_set  # noqa: E402
+
+
+@pytest.mark.parametrize('values', [None, '', ' , \n', []])
+def test_empty_values_give_an_empty_list(values):
+    assert _to_value_list(values) == []
+
+
+@pytest.mark.parametrize('method', ['Bulk Add Values', 'Bulk Delete Values'])
+def test_bulk_methods_require_values(config, method):
+    with pytest.raises(connector.ConnectorError):
+        handle_reference_set_value(config, {'method': method, 'name': 'bench_set', 'values': None})
+
+
+def test_bulk_delete_reports_the_size_after_every_delete(fake_qradar, config):
+    config['max_workers'] = 8
+    values = ['10.0.0.{}'.format(i) for i in range(20)]
+    res = handle_reference_set_value(config, {'method': 'Bulk Delete Values', 'name': 'bench_set',
+                                              'values': values})
+    assert res['succeeded'] == 20
+    assert res['number_of_elements'] == len(fake_qradar.reference_sets['bench_set']) == 980
+
+
+@pytest.mark.parametrize('values', [None, '', []])
+def test_sync_refuses_to_empty_a_set_by_default(fake_qradar, config, values):
+    with pytest.raises(connector.ConnectorError):
+        sync_reference_set(config, {'name': 'bench_set', 'values': values})
+    assert len(fake_qradar.reference_sets['bench_set']) == 1000
+
+
+def test_sync_empties_a_set_when_allowed(fake_qradar, config):
+    res = sync_reference_set(config, {'name': 'bench_set', 'values': None, 'allow_empty': True})
+    assert res['removed'] == 1000
+    assert fake_qradar.reference_sets['bench_set'] == []
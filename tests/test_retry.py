@@ -0,0 +1,47 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import pytest
+
+exceptions = pytest.importorskip('requests.exceptions')
+
+from qradar.retry import RetryPolicy  # noqa: E402
+
+
+@pytest.fixture
+def policy():
+    return RetryPolicy(max_retries=3)
+
+
+@pytest.mark.parametrize('status_code', [502, 503, 504, 429])
+def test_get_is_retried_on_transient_statuses(policy, status_code):
+    assert policy.is_retryable('GET', 0, status_code=status_code)
+
+
+@pytest.mark.parametrize('status_code', [502, 503, 504])
+def test_post_is_not_retried_unless_idempotent(policy, status_code):
+    assert not policy.is_retryable('POST', 0, status_code=status_code)
+    assert policy.is_retryable('POST', 0, status_code=status_code, idempotent=True)
+
+
+def test_post_is_retried_on_429(policy):
+    assert policy.is_retryable('POST', 0, status_code=429)
+
+
+@pytest.mark.parametrize('status_code', [200, 400, 404, 500])
+def test_other_statuses_are_final(policy, status_code):
+    assert not policy.is_retryable('GET', 0, status_code=status_code)
+
+
+def test_connection_errors(policy):
+    assert policy.is_retryable('GET', 0, error=exceptions.ConnectionError())
+    assert not policy.is_retryable('POST', 0, error=exceptions.ConnectionError())
+    assert not policy.is_retryable('GET', 0, error=exceptions.SSLError())
+    assert not policy.is_retryable('GET', 0, error=exceptions.ReadTimeout())
+
+
+def test_retries_stop_after_max_retries(policy):
+    assert policy.is_retryable('GET', 2, status_code=503)
+    assert not policy.is_retryable('GET', 3, status_code=503)
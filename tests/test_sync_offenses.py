@@ -0,0 +1,60 @@
+""" Copyright start
+  Copyright (C) 2008 - 2022 Fortinet Inc.
+  All rights reserved.
+  FORTINET CONFIDENTIAL & FORTINET PROPRIETARY SOURCE CODE
+  Copyright end """
+import os
+
+import pytest
+
+pytest.importorskip('connectors.core.connector')
+
+from qradar import conn  # noqa: E402
+from qradar.funcs import _to_epoch_millis, sync_offenses  # noqa: E402
+
+
+@pytest.fixture
+def params(tmp_path):
+    return {'state_file': str(tmp_path / 'sync.json'), 'start_time': 0, 'page_size': 3}
+
+
+def test_sync_resumes_where_the_previous_run_stopped(fake_qradar, config, params):
+    fake_qradar.offense_count = 40
+    seen = []
+    for _ in range(4):
+        res = sync_offenses(config, dict(params, max_results=10))
+        seen += [offense['id'] for offense in res['offenses']]
+    assert seen == list(range(1, 41))
+    assert sync_offenses(config, params)['count'] == 0
+    # offenses updated after the previous run are returned by the next one
+    fake_qradar.offense_count = 45
+    assert [offense['id'] for offense in sync_offenses(config, params)['offenses']] == list(range(41, 46))
+
+
+def test_sync_breaks_last_updated_time_ties_by_id(fake_qradar, config, params):
+    fake_qradar.offense_count = 20
+    # four offenses share each last_updated_time, so every page of 3 ends inside a block
+    res = sync_offenses(config, dict(params, max_results=6))
+    assert [offense['id'] for offense in res['offenses']] == [1, 2, 3, 4, 5, 6]
+    assert (res['last_updated_time'], res['last_id']) == (1600000000001, 6)
+    res = sync_offenses(config, params)
+    assert [offense['id'] for offense in res['offenses']] == list(range(7, 21))
+
+
+def test_default_state_file_survives_a_token_change(fake_qradar, config, tmp_path, monkeypatch):
+    monkeypatch.setattr(conn, 'STATE_DIR', str(tmp_path))
+    fake_qradar.offense_count = 8
+    first = sync_offenses(config, {'start_time': 0, 'sync_name': 'test'})
+    assert first['count'] == 8
+    rotated = dict(config, token='rotated-token', verify_ssl=True)
+    second = sync_offenses(rotated, {'start_time': 0, 'sync_name': 'test'})
+    assert second['state_file'] == first['state_file']
+    assert second['count'] == 0
+    assert os.path.dirname(first['state_file']) == str(tmp_path)
+
+
+@pytest.mark.parametrize('value', ['2020-09-13T12:26:40.000Z', '2020-09-13T12:26:40Z', '2020-09-13T12:26:40',
+                                   '2020-09-13T14:26:40+02:00', '2020-09-13T12:26:40.000000+00:00',
+                                   1600000000000, '1600000000000'])
+def test_start_time_formats(value):
+    assert _to_epoch_millis(value) == 1600000000000